@@ -0,0 +1,57 @@
+"""Keeps the FastAPI document catalog in step with the ingestion manifest.
+
+The manifest records the vectors of pipeline documents, the catalog those of
+every document and is what Streamlit lists and deletes from. Catalog calls
+are skipped when FASTAPI_ENDPOINT is not set.
+"""
+import os
+from functools import lru_cache
+
+import requests
+
+FASTAPI_ENDPOINT = os.getenv('FASTAPI_ENDPOINT')
+FASTAPI_USERNAME = os.getenv('FASTAPI_USERNAME')
+FASTAPI_PASSWORD = os.getenv('FASTAPI_PASSWORD')
+TIMEOUT = 30
+
+
+def enabled():
+    return bool(FASTAPI_ENDPOINT)
+
+
+@lru_cache(maxsize=None)
+def get_session():
+    session = requests.Session()
+    response = session.post(f"{FASTAPI_ENDPOINT}/token", timeout=TIMEOUT,
+                            data={'username': FASTAPI_USERNAME, 'password': FASTAPI_PASSWORD})
+    response.raise_for_status()
+    session.headers['Authorization'] = f"Bearer {response.json()['access_token']}"
+    return session
+
+
+def deleted_documents():
+    """Filenames the catalog marks deleted, e.g. deleted from Streamlit."""
+    if not enabled():
+        return set()
+    response = get_session().get(f"{FASTAPI_ENDPOINT}/documents", params={'include_deleted': 'true'},
+                                 timeout=TIMEOUT)
+    response.raise_for_status()
+    return {d['filename'] for d in response.json()['documents'] if d['status'] == 'deleted'}
+
+
+def vector_ids(filename):
+    if not enabled():
+        return []
+    response = get_session().get(f"{FASTAPI_ENDPOINT}/documents/{filename}/vectors", timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()['ids'] or []
+
+
+def update(filename, status, ids):
+    if not enabled():
+        return
+    response = get_session().put(f"{FASTAPI_ENDPOINT}/documents/{filename}", timeout=TIMEOUT,
+                                 json={'status': status, 'chunk_count': len(ids), 'vector_ids': ids,
+                                       'first_id': ids[0] if ids else None,
+                                       'last_id': ids[-1] if ids else None})
+    response.raise_for_status()
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from pdf_wizard.pdf_text import spool_to_file
+
+MAX_WORKERS = 16
+PER_HOST = 4
+TIMEOUT = (10, 120)  # connect, read
+
+
+def make_session(pool_size=MAX_WORKERS, retries=3):
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET', 'HEAD'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class Downloader:
+    """Fetches many URLs concurrently through one pooled session.
+
+    At most per_host requests run against the same host at a time.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, per_host=PER_HOST, timeout=TIMEOUT, session=None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.session = session or make_session(max_workers)
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def fetch(self, url, headers=None):
+        """Download url into a temp file, returns (response, file).
+
+        file is None when a conditional request comes back 304 Not Modified.
+        """
+        with self._host_slot(url):
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                if response.status_code == 304:
+                    return response, None
+                return response, spool_to_file(response)
+
+    def iter_downloads(self, urls, headers=None):
+        """Yield (url, response, file) in the order the downloads finish.
+
+        headers optionally maps a URL to extra request headers for it.
+        """
+        headers = headers or {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, url, headers.get(url)): url for url in urls}
+            for future in as_completed(futures):
+                response, pdf_file = future.result()
+                yield futures[future], response, pdf_file
+
+
+def iter_downloads(urls, headers=None, **kwargs):
+    return Downloader(**kwargs).iter_downloads(urls, headers)
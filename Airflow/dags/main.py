@@ -1,39 +1,53 @@
 import os
-import io
+import hashlib
+from datetime import timedelta
+from functools import lru_cache
 from airflow import DAG
-from airflow.operators.bash_operator import BashOperator
 from airflow.operators.python_operator import PythonOperator
 from airflow.utils.dates import days_ago
-from datetime import timedelta
-import PyPDF2
-import requests
-import csv
-import boto3
-import pandas as pd
-from textblob import TextBlob
-import nltk
-nltk.download('punkt')
-import openai
-from openai import OpenAI, AsyncOpenAI
-import tiktoken
-import time
-import pinecone
-import ast
-import pkg_resources
 from airflow.models.param import Param
-import pkg_resources
 
-try:
-    pinecone.init(api_key=os.getenv('PINECONE'), environment='gcp-starter')
-    index = pinecone.Index('bigdata')
-    print("Pinecone initialization and index creation successful.")
-except Exception as e:
-    print("An error occurred:", str(e))
+# The scheduler re-parses this file every min_file_process_interval, so keep
+# top-level code cheap: heavy libraries are imported inside the task
+# callables and clients are created on first use.
+
+
+@lru_cache(maxsize=None)
+def get_index():
+    if os.getenv('VECTOR_STORE', 'pinecone') == 'local':
+        from pdf_wizard.vector_store import open_local_index
+        return open_local_index()
+    import pinecone
+    try:
+        pinecone.init(api_key=os.getenv('PINECONE'), environment='gcp-starter')
+        index = pinecone.Index('bigdata')
+        print("Pinecone initialization and index creation successful.")
+    except Exception as e:
+        print("An error occurred:", str(e))
+        raise
+    return index
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    import boto3
+    a_key = os.getenv('A_KEY')
+    sa_key = os.getenv('SA_KEY')
+
+    # Configure AWS credentials
+    os.environ['AWS_ACCESS_KEY_ID'] = a_key
+    os.environ['AWS_SECRET_ACCESS_KEY'] = sa_key
+
+    return boto3.client('s3')
 
 
 s3_bucket = 'csv07'
-s3_object_key = 'extract.csv'
-openai.api_key = os.getenv('OPENAI_API')
+s3_prefix = 'extract'
+manifest_path = 'manifest.json'
+# Written by Pipeline-1 next to the extract, committed by Pipeline-2 once the
+# extract is in the index. Until then the next Pipeline-1 run stages it again
+pending_manifest_path = s3_prefix + '.manifest.json'
+OPENAI_API_KEY = os.getenv('OPENAI_API')
 EMBEDDING_MODEL = "text-embedding-ada-002"
 GPT_MODEL = "gpt-3.5-turbo"
 pdf_links_list = [
@@ -45,85 +59,93 @@ pdf_links_list = [
                   ]
 
 # Function to extract content from a PDF link
-def extract_pdf_content(links, output_csv_file):
-    column_names = ["Filename","Metadata", "Text", "Embeddings"]
-    df = pd.DataFrame(columns=column_names)
-    for i in links:
+def extract_pdf_content(links, output_prefix):
+    import pandas as pd
+    import catalog
+    from pdf_wizard.chunking import create_chunk_list, chunking_signature
+    from downloads import iter_downloads
+    from pdf_wizard.manifest import chunk_hash, vector_id
+    from pdf_wizard.pdf_text import map_file, read_pdf
+    from pdf_wizard.segmenter import iter_sentences
+    from staging import write_staging, staging_paths
+
+    manifest = load_manifest()
+    chunking = chunking_signature()
+    frames = []
+    deleted_ids = []
+    # Documents deleted from Streamlit are forgotten so they are ingested again.
+    # Their vectors are already gone, and the new ones get the same IDs
+    removed = catalog.deleted_documents()
+    for url in [url for url in manifest.documents if url.split('/')[-1] in removed]:
+        manifest.remove(url)
+    # Documents the manifest knows about but that are no longer listed
+    for url in set(manifest.documents) - set(links):
+        deleted_ids += manifest.remove(url)
+    headers = {url: manifest.conditional_headers(url, chunking) for url in links}
+    # Documents are extracted as soon as their download finishes
+    for i, pdf_response, pdf_file in iter_downloads(links, headers):
         filename = i.split('/')[-1]
-        pdf_response = requests.get(i)
-        pdf_content = pdf_response.content
-        meta_data, pdf_text = extract_text_with_pypdf2(pdf_content)
-        sentences_list = extract_sentences(pdf_text.strip())
-        print(sentences_list[0])
-        chunk_list = create_chunk_list(sentences_list)
-        embeddings_list = gen_embed(chunk_list)
-        df_temp = pd.DataFrame({'Filename':filename,'Metadata': meta_data,'Text': chunk_list, 'Embeddings': embeddings_list})
-        df = pd.concat([df, df_temp], ignore_index=True)
-    df.to_csv(output_csv_file, index=True)
-    upload_csv_to_s3(output_csv_file, 'extract.csv')
-
-
-def extract_sentences(text):
-    blob = TextBlob(text)
-    sentence_list = []
-    # Iterate through the sentences and append them to the list
-    for sentence in blob.sentences:
-        sentence_list.append(sentence.raw)
-    return sentence_list
-
-
-def create_chunk_list(sentence_list):
-    l = len(sentence_list)
-    chunk_list = []
-    chunk = ''
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    for i in range(l):
-        chunk+=sentence_list[i]
-        if len(encoding.encode(chunk))<3000:
-            if i==l-1:
-                chunk_list.append(chunk)
+        if pdf_file is None:
+            print("Not modified:", filename)
             continue
-        else:
-            chunk_list.append(chunk)
-            chunk = ''
-    return chunk_list
+        # Pages are extracted, split and chunked one at a time
+        with pdf_file, map_file(pdf_file) as pdf_content:
+            content_hash = hashlib.sha256(pdf_content).hexdigest()
+            if manifest.content_unchanged(i, content_hash, chunking):
+                print("Unchanged:", filename)
+                manifest.update(i, pdf_response, content_hash, chunking=chunking)
+                continue
+            meta_data, pages = read_pdf(pdf_content)
+            chunk_list = create_chunk_list(iter_sentences(pages))
+        # Only chunks that were not ingested before are embedded and upserted
+        old_hashes = manifest.chunk_hashes(i)
+        hashes = [chunk_hash(chunk) for chunk in chunk_list]
+        new_chunks = {h: chunk for h, chunk in zip(hashes, chunk_list) if h not in old_hashes}
+        deleted_ids += [vector_id(filename, h) for h in old_hashes - set(hashes)]
+        print(f"{filename}: {len(new_chunks)} new chunks, {len(old_hashes - set(hashes))} removed")
+        embeddings_list = gen_embed(list(new_chunks.values()))
+        df_temp = pd.DataFrame({'Filename':filename,'Metadata': meta_data,'Text': list(new_chunks.values()), 'Embeddings': embeddings_list},
+                               index=[vector_id(filename, h) for h in new_chunks])
+        frames.append(df_temp)
+        manifest.update(i, pdf_response, content_hash, hashes, chunking)
+    column_names = ["Filename","Metadata", "Text", "Embeddings"]
+    df = pd.concat(frames) if frames else pd.DataFrame(columns=column_names)
+    embeddings = df.pop('Embeddings').tolist()
+    write_staging(df, embeddings, output_prefix, deleted_ids)
+    for path, key in zip(staging_paths(output_prefix), staging_paths(s3_prefix)):
+        upload_to_s3(path, key)
+    manifest.save(pending_manifest_path)
+    upload_to_s3(pending_manifest_path, pending_manifest_path)
 
 
+def load_manifest(key=manifest_path):
+    import botocore
+    from pdf_wizard.manifest import Manifest
 
-def gen_embed(chunk_list):
-    client = OpenAI(api_key=openai.api_key)
-    embed_list = []
-    for i in chunk_list:
-        text_embedding_response = client.embeddings.create(
-             input=i,
-            model=EMBEDDING_MODEL,
-        )
-        print("The text embedding response is:",text_embedding_response)
-        print("The text embedding response is:",text_embedding_response.data[0].embedding)
-        text_embedding = text_embedding_response.data[0].embedding
-        embed_list.append(text_embedding)
-        time.sleep(20)
-    return embed_list
+    s3_client = get_s3_client()
+    try:
+        s3_client.download_file(s3_bucket, key, key)
+    except botocore.exceptions.ClientError as e:
+        # First run, nothing has been ingested yet
+        print("No manifest found:", str(e))
+        return None if key != manifest_path else Manifest()
+    return Manifest.load(key)
 
 
+def gen_embed(chunk_list):
+    from pdf_wizard.embeddings import EmbeddingEngine
+    from pdf_wizard.embedding_cache import get_cache
 
-def extract_text_with_pypdf2(pdf_content):
-    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-    text = ""
-    # Access the metadata
-    meta_data = pdf_reader.metadata
-    meta_data = list(meta_data.values())[0]
-    # Print metadata information
-    # for key, value in meta_data.items():
-    #     print(f"{key}: {value}")
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text += page.extract_text()
-    return [meta_data,text]
+    cache = get_cache()
+    engine = EmbeddingEngine(OPENAI_API_KEY, EMBEDDING_MODEL, cache=cache)
+    embed_list = engine.embed(chunk_list)
+    print("Embedding cache:", cache.stats())
+    return embed_list
 
 
 
 def print_csv(output_csv_file):
+    import csv
     with open(output_csv_file, 'r', newline='') as file:
         csv_reader = csv.reader(file)
         for row in csv_reader:
@@ -131,75 +153,65 @@ def print_csv(output_csv_file):
 
 
 
-def upload_csv_to_s3(csv_file_path, s3_object_key):
-    a_key = os.getenv('A_KEY')
-    sa_key = os.getenv('SA_KEY')
+def upload_to_s3(file_path, s3_object_key):
+    s3_client = get_s3_client()
 
-    # Configure AWS credentials
-    os.environ['AWS_ACCESS_KEY_ID'] = a_key
-    os.environ['AWS_SECRET_ACCESS_KEY'] = sa_key
-
-    s3_client = boto3.client('s3')
-
-    # Upload the CSV file, replacing it if it already exists.
-    s3_client.upload_file(csv_file_path, 'csv07', s3_object_key)
+    # Upload the file, replacing it if it already exists.
+    s3_client.upload_file(file_path, 'csv07', s3_object_key)
 
 
 def update_db(file):
-    a_key = os.getenv('A_KEY')
-    sa_key = os.getenv('SA_KEY')
-
-    # Configure AWS credentials
-    os.environ['AWS_ACCESS_KEY_ID'] = a_key
-    os.environ['AWS_SECRET_ACCESS_KEY'] = sa_key
-
-    s3_client = boto3.client('s3')
-
-    # Download the CSV file from S3 to a local temporary file
-    local_csv_file_path = "./extract.csv"
-    s3_client.download_file(s3_bucket, s3_object_key, local_csv_file_path)
-
-    df = get_df(local_csv_file_path)
-    add_to_pinecone(df)
-
-
-
-def get_df(path):
-    df = pd.read_csv(path)
-    df['Embeddings'] = df['Embeddings'].apply(ast.literal_eval)
-
-    return df.copy()
-    
-
-def add_to_pinecone(df):
-
-    df = df.rename(columns={df.columns[0]: 'Index'})
-    df['Index'] = df['Index'].astype(str)
-
-    # Setting batch size as 32
-    batch_size = 32
-    for i in range(0, len(df), batch_size):
-        batch_df = df[i:i + batch_size]
-        id_list = batch_df['Index'].tolist()
-        embeds = batch_df['Embeddings'].tolist()
-        text_list = batch_df['Text'].tolist()
-        file_list = batch_df['Filename'].tolist()
-        metalist = batch_df['Metadata'].tolist()
-        m_list = []
-        for i in range(len(text_list)):
-            m = {'Filename': file_list[i], 'Text': text_list[i], 'Metadata': metalist[i]}
-            m_list.append(m)
-        # meta = [{'text': text_batch} for text_batch in zip(metalist, text_list)]
-        to_upsert = zip(id_list, embeds, m_list) 
-        index.upsert(vectors=list(to_upsert))
-    #pinecone.deinit()
+    import catalog
+    from staging import read_staging, staging_paths
+    from pdf_wizard.vector_store import flush
+
+    s3_client = get_s3_client()
+
+    # Download the staged extract from S3 to local files
+    local_prefix = "./extract"
+    for key, path in zip(staging_paths(s3_prefix), staging_paths(local_prefix)):
+        s3_client.download_file(s3_bucket, key, path)
+
+    pending = load_manifest(pending_manifest_path)
+    if pending is None:
+        print("Nothing staged")
+        return
+    df, embeddings, deleted_ids = read_staging(local_prefix)
+    # Documents deleted since the extract was staged stay deleted
+    staged = df['Filename'].isin({url.split('/')[-1] for url in pending.documents}).to_numpy()
+    df, embeddings = df[staged], embeddings[staged]
+    add_to_pinecone(df, embeddings)
+    # Vectors of chunks that disappeared from their document
+    for i in range(0, len(deleted_ids), 1000):
+        get_index().delete(ids=deleted_ids[i:i + 1000])
+    flush(get_index())
+    # The extract is in the index, its manifest becomes the baseline
+    committed = load_manifest()
+    upload_to_s3(pending_manifest_path, manifest_path)
+    # and the catalog records the vectors of every pipeline document
+    for url in set(committed.documents) - set(pending.documents):
+        catalog.update(url.split('/')[-1], "deleted", [])
+    for url in pending.documents:
+        catalog.update(url.split('/')[-1], "ready", pending.vector_ids(url))
+    print(f"Upserted {len(df)} vectors, deleted {len(deleted_ids)}")
+
+
+
+def add_to_pinecone(df, embeddings):
+    from pdf_wizard.upserts import upsert_frame
+
+    # The first column holds the vector IDs
+    ids = df[df.columns[0]].astype(str).tolist()
+    count = upsert_frame(get_index(), ids, embeddings, df)
+    print(f"Upserted {count} vectors")
 
 
 
 def search_pinecone_and_return_text(query):
-    client = OpenAI(api_key=openai.api_key)
+    from openai import OpenAI
+    client = OpenAI(api_key=OPENAI_API_KEY)
     xq = client.embeddings.create(input=query, model="text-embedding-ada-002").data[0].embedding
-    res = index.query([xq], top_k=1, include_metadata=True)
+    res = get_index().query([xq], top_k=1, include_metadata=True)
     print("search_pinecone ",res['matches'][0]['metadata']['Text'])
     
     results = []
@@ -219,6 +231,7 @@ async def answer_question(results, query):
     prompt = f"Context: {results}\nQuestion: {query}\nAnswer:"
 
 
+    from openai import AsyncOpenAI
     client = AsyncOpenAI()
 
     response = await client.chat.completions.create(
@@ -241,15 +254,32 @@ def qa(**kwargs):
     a = answer_question(context,q)
     print(a)
  ###################
-import numpy as np
 def delete_entries(**kwargs):
+    import catalog
+    from pdf_wizard.upserts import delete_ids, delete_by_filter_query
+    from pdf_wizard.vector_store import flush
+    index = get_index()
     filename_to_delete = kwargs["params"]["filename"]
-    input_vector = np.random.rand(1536).tolist()
-    results = index.query(vector=input_vector, top_k=10000,include_values=False, filter={"Filename": filename_to_delete})
-    all_ids = [match['id'] for match in results['matches']]
-    print(all_ids)
-    delete_response = index.delete(ids=[all_ids[0]], namespace='')
-    print(delete_response)
+    # The manifests know every vector ID a pipeline-ingested document owns,
+    # the catalog those of a document uploaded from Streamlit. A staged
+    # manifest not yet committed is updated too, or committing it would
+    # record the document as ingested again
+    ids = set(catalog.vector_ids(filename_to_delete))
+    for key in (manifest_path, pending_manifest_path):
+        manifest = load_manifest(key)
+        urls = manifest.urls_for(filename_to_delete) if manifest else []
+        for url in urls:
+            ids.update(manifest.remove(url))
+        if urls:
+            manifest.save(key)
+            upload_to_s3(key, key)
+    if ids:
+        deleted = delete_ids(index, ids)
+    else:
+        deleted = delete_by_filter_query(index, filename_to_delete)
+    flush(index)
+    catalog.update(filename_to_delete, "deleted", [])
+    print(f"Deleted {deleted} vectors of {filename_to_delete}")
 
 
 ##########################################################################################
@@ -268,7 +298,7 @@ dag = DAG(
 pdf_processing_task = PythonOperator(
     task_id="pdf_extract",
     python_callable=extract_pdf_content,
-    op_args=[pdf_links_list, "output.csv"],
+    op_args=[pdf_links_list, "output"],
     dag=dag,
 )
 
@@ -0,0 +1,61 @@
+"""Staging format handed from Pipeline-1 to Pipeline-2.
+
+Each extract is three files sharing a prefix: <prefix>.npy holds the
+embeddings as one float32 matrix, <prefix>.meta.csv holds the Filename,
+Metadata and Text of every row in the same order, and <prefix>.deleted.json
+lists vector IDs that Pipeline-2 should remove. The first column of the
+metadata table is the vector ID, like the row index of the old extract.csv.
+
+Convert an old extract.csv with: python staging.py extract.csv extract
+"""
+import ast
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+EMBEDDING_DIM = 1536
+
+
+def staging_paths(prefix):
+    return prefix + '.npy', prefix + '.meta.csv', prefix + '.deleted.json'
+
+
+def write_staging(df, embeddings, prefix, deleted_ids=()):
+    npy_path, meta_path, deleted_path = staging_paths(prefix)
+    if len(df):
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(df), -1)
+    else:
+        matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    np.save(npy_path, matrix)
+    df[['Filename', 'Metadata', 'Text']].to_csv(meta_path, index=True)
+    with open(deleted_path, 'w') as f:
+        json.dump(list(deleted_ids), f)
+    return npy_path, meta_path, deleted_path
+
+
+def read_staging(prefix):
+    """Return the metadata DataFrame, a read-only memory-mapped embedding
+    matrix and the list of vector IDs to delete."""
+    npy_path, meta_path, deleted_path = staging_paths(prefix)
+    df = pd.read_csv(meta_path)
+    embeddings = np.load(npy_path, mmap_mode='r')
+    if len(df) != len(embeddings):
+        raise ValueError(f"{meta_path} has {len(df)} rows but {npy_path} has {len(embeddings)}")
+    with open(deleted_path) as f:
+        deleted_ids = json.load(f)
+    return df, embeddings, deleted_ids
+
+
+def convert_csv(csv_path, prefix):
+    """Convert an extract.csv with stringified embedding lists to the staging format."""
+    df = pd.read_csv(csv_path, index_col=0)
+    embeddings = np.empty((len(df), EMBEDDING_DIM), dtype=np.float32)
+    for i, value in enumerate(df['Embeddings']):
+        embeddings[i] = ast.literal_eval(value)
+    return write_staging(df, embeddings, prefix)
+
+
+if __name__ == '__main__':
+    print(convert_csv(sys.argv[1], sys.argv[2]))
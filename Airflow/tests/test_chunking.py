@@ -0,0 +1,79 @@
+"""create_chunk_list keeps the boundaries of the old re-encode-everything loop
+when overlap is 0. A stub encoder stands in for tiktoken, it merges words
+across sentence boundaries like BPE merges tokens.
+
+Run from the repository root with pdf_wizard installed (pip install ./common):
+python -m pytest Airflow/tests
+"""
+import random
+import re
+
+import pytest
+
+from pdf_wizard import chunking
+
+
+class StubEncoding:
+    def encode(self, text):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+
+@pytest.fixture(autouse=True)
+def stub_encoding(monkeypatch):
+    monkeypatch.setattr(chunking, 'get_encoding', lambda model=chunking.GPT_MODEL: StubEncoding())
+
+
+def old_create_chunk_list(sentence_list, max_tokens):
+    # The loop create_chunk_list replaced, with the limit as a parameter
+    encoding = StubEncoding()
+    chunk_list = []
+    chunk = ''
+    for i, sentence in enumerate(sentence_list):
+        chunk += sentence
+        if len(encoding.encode(chunk)) < max_tokens:
+            if i == len(sentence_list) - 1:
+                chunk_list.append(chunk)
+            continue
+        chunk_list.append(chunk)
+        chunk = ''
+    return chunk_list
+
+
+def generate_sentences(count, seed, leading_space=0.8):
+    rng = random.Random(seed)
+    words = ['form', 'filing', 'fee', 'issuer', 'offering', 'tier', 'shall', 'securities', 'state', 'a']
+    sentences = []
+    for _ in range(count):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 40)))
+        # Without a leading space the first word merges with the previous sentence's last
+        sentences.append((' ' if rng.random() < leading_space else '') + text + rng.choice(['.', '', ';']))
+    return sentences
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('max_tokens', [20, 100, 400])
+def test_same_boundaries_as_old_loop_without_overlap(seed, max_tokens):
+    sentences = generate_sentences(300, seed)
+    assert chunking.create_chunk_list(sentences, max_tokens, overlap_tokens=0) == \
+        old_create_chunk_list(sentences, max_tokens)
+
+
+def test_overlap_repeats_trailing_sentences():
+    max_tokens, overlap_tokens = 100, 30
+    # Numbered sentences that never merge, so chunks can be mapped back to them
+    sentences = [f" s{i} " + text.strip() + "." for i, text in enumerate(generate_sentences(300, 0, 1))]
+    chunks = chunking.create_chunk_list(sentences, max_tokens, overlap_tokens)
+    encoding = StubEncoding()
+    numbers = [[int(n) for n in re.findall(r" s(\d+) ", chunk)] for chunk in chunks]
+    overlaps = 0
+    for chunk, previous, current in zip(chunks, numbers, numbers[1:]):
+        assert len(encoding.encode(chunk)) >= max_tokens
+        carried = [n for n in current if n <= previous[-1]]
+        overlaps += bool(carried)
+        # The next chunk starts with the last sentences of this one, within the overlap budget
+        assert carried == previous[len(previous) - len(carried):]
+        assert len(encoding.encode(''.join(sentences[n] for n in carried))) <= overlap_tokens
+        assert current[len(carried)] == previous[-1] + 1
+    assert overlaps
+    # Every sentence is in some chunk, in order
+    assert sorted({n for chunk in numbers for n in chunk}) == list(range(len(sentences)))
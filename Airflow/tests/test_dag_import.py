@@ -0,0 +1,61 @@
+"""The scheduler re-parses main.py every min_file_process_interval, so the
+DAG file must import quickly and leave the heavy libraries to the tasks.
+
+Run from the repository root with: python -m pytest Airflow/tests
+"""
+import json
+import os
+import subprocess
+import sys
+
+DAGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'dags')
+IMPORT_BUDGET_SECONDS = 1.0
+HEAVY_MODULES = ['pandas', 'PyPDF2', 'tiktoken', 'openai', 'boto3', 'pinecone', 'textblob', 'nltk']
+
+# Imports main.py in a fresh interpreter with airflow stubbed out, so only
+# the DAG file's own imports are measured and land in sys.modules. Sockets
+# refuse to connect, any network call at parse time fails the import
+PARSE_SCRIPT = """
+import json, socket, sys, time, types
+
+def no_network(*args, **kwargs):
+    raise OSError("network access while parsing the DAG file")
+
+socket.socket.connect = no_network
+socket.socket.connect_ex = no_network
+socket.create_connection = no_network
+
+class Stub:
+    def __init__(self, *args, **kwargs):
+        pass
+
+for name in ['airflow', 'airflow.operators', 'airflow.operators.python_operator',
+             'airflow.utils', 'airflow.utils.dates', 'airflow.models', 'airflow.models.param']:
+    sys.modules[name] = types.ModuleType(name)
+sys.modules['airflow'].DAG = Stub
+sys.modules['airflow.operators.python_operator'].PythonOperator = Stub
+sys.modules['airflow.utils.dates'].days_ago = lambda n: None
+sys.modules['airflow.models.param'].Param = Stub
+
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+"""
+
+
+def parse_dag_file():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [DAGS_DIR, os.getenv('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-c', PARSE_SCRIPT], cwd=DAGS_DIR, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_dag_file_imports_within_budget():
+    assert parse_dag_file()['elapsed'] < IMPORT_BUDGET_SECONDS
+
+
+def test_dag_file_leaves_heavy_imports_to_tasks():
+    modules = set(parse_dag_file()['modules'])
+    assert not [name for name in HEAVY_MODULES if name in modules]
@@ -0,0 +1,102 @@
+"""EmbeddingEngine against a local fake of the embeddings endpoint.
+
+Run from the repository root with pdf_wizard installed (pip install ./common):
+python -m pytest Airflow/tests
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from pdf_wizard import chunking
+from pdf_wizard.embeddings import EmbeddingEngine, RateLimiter
+
+
+class StubEncoding:
+    def encode(self, text):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+
+class FakeEmbeddings(BaseHTTPRequestHandler):
+    """Embeds a text as [its word count, its position in the request], and
+    answers with the data in reverse order like the API is allowed to."""
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests.append(body['input'])
+            status, headers = server.failures.pop(0) if server.failures else (200, {})
+        if status != 200:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        data = [{'index': i, 'embedding': [float(len(text.split())), float(i)]} for i, text in enumerate(body['input'])]
+        payload = json.dumps({'data': data[::-1]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def stub_encoding(monkeypatch):
+    monkeypatch.setattr(chunking, 'get_encoding', lambda model=chunking.GPT_MODEL: StubEncoding())
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeEmbeddings)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.failures = []   # (status, headers) to answer with before succeeding
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_engine(server, **kwargs):
+    api_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return EmbeddingEngine('test-key', api_base=api_base, limiter=RateLimiter(rpm=100000, tpm=10 ** 9), **kwargs)
+
+
+def test_batches_split_by_item_and_token_budget(server):
+    texts = [' '.join(['word'] * n) for n in [5, 5, 5, 20, 1, 1, 1, 1]]
+    embeddings = make_engine(server, max_batch_tokens=20, max_batch_items=3, max_workers=1).embed(texts)
+    assert server.requests == [texts[0:3], texts[3:4], texts[4:7], texts[7:8]]
+    assert [embedding[0] for embedding in embeddings] == [5, 5, 5, 20, 1, 1, 1, 1]
+
+
+def test_out_of_order_data_is_put_back_in_order(server):
+    texts = [f"text {i}" for i in range(10)]
+    embeddings = make_engine(server).embed(texts)
+    # The second value is the text's position in its request
+    assert [embedding[1] for embedding in embeddings] == list(range(10))
+
+
+def test_rate_limited_request_is_retried_after_retry_after(server):
+    server.failures.append((429, {'Retry-After': '0.2'}))
+    start = time.monotonic()
+    embeddings = make_engine(server).embed(['one two', 'three'])
+    assert time.monotonic() - start >= 0.2
+    assert len(server.requests) == 2
+    assert [embedding[0] for embedding in embeddings] == [2, 1]
+
+
+def test_other_errors_are_raised(server):
+    server.failures.append((500, {}))
+    with pytest.raises(requests.HTTPError):
+        make_engine(server).embed(['one two'])
+    assert len(server.requests) == 1
@@ -0,0 +1,94 @@
+"""upsert_frame against LocalIndex standing in for Pinecone.
+
+Run from the repository root with pdf_wizard installed (pip install ./common):
+python -m pytest Airflow/tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pdf_wizard import upserts
+from pdf_wizard.upserts import batch_bounds, delete_ids, payload_sizes, upsert_frame
+from pdf_wizard.vector_store import LocalIndex
+
+DIMENSION = 8
+
+
+class FlakyIndex(LocalIndex):
+    """Fails the first upserts it gets: ('raise',) raises, ('short', n) only
+    stores the first n vectors and reports that count."""
+
+    def __init__(self, failures=()):
+        super().__init__(dimension=DIMENSION)
+        self.failures = list(failures)
+        self.batches = []
+
+    def upsert(self, vectors, namespace=''):
+        self.batches.append([vector[0] for vector in vectors])
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == ('raise',):
+            raise ConnectionError("connection reset")
+        if failure and failure[0] == 'short':
+            super().upsert(vectors[:failure[1]])
+            return {'upserted_count': failure[1]}
+        return super().upsert(vectors)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(upserts.time, 'sleep', lambda seconds: None)
+
+
+def make_frame(n, text_bytes=10):
+    ids = [f"doc.pdf-{i}" for i in range(n)]
+    df = pd.DataFrame({'Filename': 'doc.pdf', 'Text': ['x' * text_bytes] * n, 'Metadata': 'meta'})
+    return ids, np.random.rand(n, DIMENSION), df
+
+
+def test_batch_bounds_respect_bytes_and_vector_limits():
+    sizes = np.array([400, 400, 400, 900, 100, 100, 100, 100, 1500])
+    assert batch_bounds(sizes, max_bytes=1000, max_vectors=3) == \
+        [(0, 2), (2, 3), (3, 5), (5, 8), (8, 9)]
+
+
+def test_batches_are_sized_by_payload_bytes():
+    ids, embeddings, df = make_frame(50, text_bytes=1000)
+    sizes = payload_sizes(ids, embeddings.astype(np.float32), df)
+    index = FlakyIndex()
+    assert upsert_frame(index, ids, embeddings, df, max_bytes=int(sizes[0] * 4.5), workers=1) == 50
+    assert [len(batch) for batch in index.batches] == [4] * 12 + [2]
+    assert index.describe_index_stats()['total_vector_count'] == 50
+
+
+def test_failed_batch_is_retried_whole():
+    ids, embeddings, df = make_frame(10)
+    index = FlakyIndex([('raise',)])
+    assert upsert_frame(index, ids, embeddings, df, max_vectors=10, workers=1) == 10
+    assert index.batches == [ids, ids]
+    assert index.describe_index_stats()['total_vector_count'] == 10
+
+
+def test_short_upserted_count_is_retried():
+    ids, embeddings, df = make_frame(10)
+    index = FlakyIndex([('short', 6)])
+    assert upsert_frame(index, ids, embeddings, df, max_vectors=10, workers=1) == 10
+    assert index.batches == [ids, ids]
+    assert index.describe_index_stats()['total_vector_count'] == 10
+    assert index.fetch(ids[6:])['vectors'].keys() == set(ids[6:])
+
+
+def test_gives_up_after_retries():
+    ids, embeddings, df = make_frame(3)
+    with pytest.raises(ConnectionError):
+        upsert_frame(FlakyIndex([('raise',)] * 3), ids, embeddings, df, workers=1, retries=2)
+    with pytest.raises(RuntimeError):
+        upsert_frame(FlakyIndex([('short', 1)] * 3), ids, embeddings, df, workers=1, retries=2)
+
+
+def test_delete_ids_counts_vectors_removed():
+    ids, embeddings, df = make_frame(250)
+    index = FlakyIndex()
+    upsert_frame(index, ids, embeddings, df)
+    assert delete_ids(index, ids[:200] + ['unknown-1', 'unknown-2'], max_vectors=120) == 200
+    assert delete_ids(index, ids[:200]) == 0
+    assert index.describe_index_stats()['total_vector_count'] == 50
@@ -0,0 +1,5 @@
+"""Modules shared by the Airflow DAGs, the FastAPI service and the Streamlit app.
+
+Install with `pip install ./common` from the repository root, each
+deployable does this as part of its build.
+"""
@@ -0,0 +1,81 @@
+import os
+from functools import lru_cache
+
+GPT_MODEL = "gpt-3.5-turbo"
+# Small chunks, so several of them fit the answer prompt's context budget
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '400'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '50'))
+# Within this many tokens of the limit we confirm the running count with an
+# exact encode of the chunk, so boundaries match encoding the whole chunk.
+EXACT_MARGIN = 16
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=GPT_MODEL):
+    # Loading the BPE ranks is expensive, keep one encoder per process
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(text, model=GPT_MODEL):
+    return len(get_encoding(model).encode(text))
+
+
+def iter_chunks(sentence_list, max_tokens=CHUNK_TOKENS, overlap_tokens=0, model=GPT_MODEL):
+    """Yield chunks of consecutive sentences of about max_tokens tokens each.
+
+    Token counts are kept per sentence instead of re-encoding the growing
+    chunk, so the cost is linear in the text length. A chunk is closed on the
+    sentence that takes it to max_tokens or more, like create_chunk_list
+    always did. With overlap_tokens > 0 the next chunk starts with the
+    trailing sentences of the previous one, up to that many tokens.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    encoding = get_encoding(model)
+    chunk = []        # sentences in the current chunk
+    counts = []       # token count each sentence adds to the chunk
+    total = 0
+    carried = 0       # leading sentences copied over from the previous chunk
+    prev = ''
+    for sentence in sentence_list:
+        # Count the sentence together with the one before it, so tokens that
+        # merge across the boundary are not counted twice.
+        if prev:
+            n = len(encoding.encode(prev + sentence)) - len(encoding.encode(prev))
+        else:
+            n = len(encoding.encode(sentence))
+        prev = sentence
+        chunk.append(sentence)
+        counts.append(n)
+        total += n
+        if total >= max_tokens - EXACT_MARGIN:
+            total = len(encoding.encode(''.join(chunk)))
+        if total < max_tokens:
+            continue
+        yield ''.join(chunk)
+        chunk, counts, total, carried = _overlap(chunk, counts, overlap_tokens)
+    if len(chunk) > carried:
+        yield ''.join(chunk)
+
+
+def _overlap(chunk, counts, overlap_tokens):
+    kept = 0
+    total = 0
+    for n in reversed(counts):
+        if total + n > overlap_tokens:
+            break
+        total += n
+        kept += 1
+    if not kept:
+        return [], [], 0, 0
+    return chunk[-kept:], counts[-kept:], total, kept
+
+
+def create_chunk_list(sentence_list, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    return list(iter_chunks(sentence_list, max_tokens, overlap_tokens))
+
+
+def chunking_signature(max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Identifies the chunk settings, documents chunked differently are re-ingested."""
+    return f"{GPT_MODEL}:{max_tokens}:{overlap_tokens}"
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', 'embedding_cache.sqlite')
+EMBED_CACHE_MAX_BYTES = int(os.getenv('EMBED_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+
+def normalize(text):
+    return ' '.join(text.split())
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f'{model}\0{normalize(text)}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by hash(model, normalized text).
+
+    Vectors are stored as float32 blobs. Once the stored vectors exceed
+    max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_bytes=EMBED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+    def get_many(self, model, texts):
+        """Return a list with the cached embedding or None for every text."""
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part)
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+            self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                  [(time.time(), key) for key in found])
+            self.conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model, texts, embeddings):
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            blob = array('f', embedding).tobytes()
+            rows.append((cache_key(model, text), blob, len(blob), now))
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        expired = []
+        for key, size in self.conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            expired.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany("DELETE FROM embeddings WHERE key = ?", expired)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
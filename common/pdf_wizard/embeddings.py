@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pdf_wizard.chunking import count_tokens
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Point this at a local fake server to run the pipeline offline
+API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+# Account quota for the embeddings endpoint, the defaults are the free tier
+EMBED_RPM = int(os.getenv('EMBED_RPM', '3'))
+EMBED_TPM = int(os.getenv('EMBED_TPM', '150000'))
+MAX_BATCH_TOKENS = 100000
+MAX_BATCH_ITEMS = 2048
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at rate_per_minute."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        # A request bigger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    def __init__(self, rpm=EMBED_RPM, tpm=EMBED_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, n_tokens):
+        self.requests.acquire(1)
+        self.tokens.acquire(n_tokens)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(api_key, rpm=EMBED_RPM, tpm=EMBED_TPM):
+    # Quotas are per key, so every engine using the same key shares a limiter
+    with _limiters_lock:
+        if api_key not in _limiters:
+            _limiters[api_key] = RateLimiter(rpm, tpm)
+        return _limiters[api_key]
+
+
+def make_batches(texts, max_tokens=MAX_BATCH_TOKENS, max_items=MAX_BATCH_ITEMS):
+    """Group texts into (positions, texts, token_count) batches under both budgets."""
+    batches = []
+    positions, batch, total = [], [], 0
+    for i, text in enumerate(texts):
+        n = count_tokens(text)
+        if batch and (total + n > max_tokens or len(batch) >= max_items):
+            batches.append((positions, batch, total))
+            positions, batch, total = [], [], 0
+        positions.append(i)
+        batch.append(text)
+        total += n
+    if batch:
+        batches.append((positions, batch, total))
+    return batches
+
+
+class EmbeddingEngine:
+    """Embeds many texts with multi-input requests sent concurrently under a rate limit."""
+
+    def __init__(self, api_key, model=EMBEDDING_MODEL, api_base=API_BASE, max_workers=4,
+                 max_batch_tokens=MAX_BATCH_TOKENS, max_batch_items=MAX_BATCH_ITEMS,
+                 limiter=None, cache=None, max_retries=6, timeout=60):
+        self.api_key = api_key
+        self.model = model
+        self.url = api_base.rstrip('/') + '/embeddings'
+        self.max_workers = max_workers
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.limiter = limiter or get_limiter(api_key)
+        # Optional EmbeddingCache, only cache misses are sent to the API
+        self.cache = cache
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=max_workers))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=max_workers))
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def _request(self, texts, n_tokens):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(n_tokens)
+            response = self.session.post(self.url, json={'model': self.model, 'input': texts},
+                                         timeout=self.timeout)
+            if response.status_code != 429 or attempt == self.max_retries:
+                break
+            # Only back off when the server says we are over quota
+            retry_after = response.headers.get('Retry-After')
+            time.sleep(float(retry_after) if retry_after else min(2 ** attempt, 60))
+        response.raise_for_status()
+        data = sorted(response.json()['data'], key=lambda d: d['index'])
+        return [d['embedding'] for d in data]
+
+    def embed(self, texts):
+        texts = list(texts)
+        if self.cache is not None:
+            embeddings = self.cache.get_many(self.model, texts)
+        else:
+            embeddings = [None] * len(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        batches = make_batches([texts[i] for i in missing], self.max_batch_tokens, self.max_batch_items)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [(positions, pool.submit(self._request, batch, n_tokens))
+                       for positions, batch, n_tokens in batches]
+            for positions, future in futures:
+                for i, embedding in zip(positions, future.result()):
+                    embeddings[missing[i]] = embedding
+        if self.cache is not None and missing:
+            self.cache.put_many(self.model, [texts[i] for i in missing],
+                                [embeddings[i] for i in missing])
+        return embeddings
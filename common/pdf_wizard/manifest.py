@@ -0,0 +1,82 @@
+"""Ingestion manifest used to turn Pipeline-1 into a delta job.
+
+For every document URL it records the ETag, Last-Modified and content hash
+of the last ingested download, the chunk settings it was split with and
+the hashes of its chunks. Vector IDs
+are derived from the filename and chunk hash, so an unchanged chunk keeps
+its ID across runs and only new chunks need embedding.
+"""
+import hashlib
+import json
+import os
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def vector_id(filename, hash_):
+    return f"{filename}-{hash_[:16]}"
+
+
+class Manifest:
+    def __init__(self, documents=None):
+        self.documents = documents or {}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.documents, f)
+
+    def _entry(self, url, chunking):
+        # An entry chunked with other settings does not count as ingested
+        entry = self.documents.get(url)
+        if entry is None or entry.get('chunking') != chunking:
+            return None
+        return entry
+
+    def conditional_headers(self, url, chunking=None):
+        entry = self._entry(url, chunking)
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def content_unchanged(self, url, content_hash, chunking=None):
+        entry = self._entry(url, chunking)
+        return entry is not None and entry['content_hash'] == content_hash
+
+    def chunk_hashes(self, url):
+        entry = self.documents.get(url)
+        return set(entry['chunks']) if entry else set()
+
+    def update(self, url, response, content_hash, chunks=None, chunking=None):
+        """Record a download; chunks=None keeps the chunk list of an unchanged document."""
+        entry = self.documents.setdefault(url, {'chunks': []})
+        entry['chunking'] = chunking
+        entry['etag'] = response.headers.get('ETag')
+        entry['last_modified'] = response.headers.get('Last-Modified')
+        entry['content_hash'] = content_hash
+        if chunks is not None:
+            entry['chunks'] = list(dict.fromkeys(chunks))
+
+    def vector_ids(self, url):
+        filename = url.split('/')[-1]
+        return [vector_id(filename, h) for h in self.documents.get(url, {}).get('chunks', [])]
+
+    def urls_for(self, filename):
+        return [url for url in self.documents if url.split('/')[-1] == filename]
+
+    def remove(self, url):
+        """Forget a document, returns the vector IDs it owned."""
+        ids = self.vector_ids(url)
+        self.documents.pop(url, None)
+        return ids
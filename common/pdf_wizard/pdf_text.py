@@ -0,0 +1,38 @@
+import mmap
+import tempfile
+
+import PyPDF2
+
+SPOOL_BLOCK = 1024 * 1024
+
+
+def spool_to_file(response):
+    """Write a streamed HTTP response body to an anonymous temp file."""
+    pdf_file = tempfile.TemporaryFile()
+    for block in response.iter_content(SPOOL_BLOCK):
+        pdf_file.write(block)
+    pdf_file.flush()
+    pdf_file.seek(0)
+    return pdf_file
+
+
+def map_file(pdf_file):
+    # Pages are read straight from the page cache instead of a bytes copy
+    return mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_pdf(pdf_content):
+    """Return the first metadata value and a lazy iterator over page texts.
+
+    pdf_content is any seekable binary stream, e.g. a memory-mapped file.
+    The iterator must be consumed while the stream is still open.
+    """
+    pdf_reader = PyPDF2.PdfReader(pdf_content)
+    meta_data = pdf_reader.metadata
+    meta_data = list(meta_data.values())[0]
+    return meta_data, iter_page_texts(pdf_reader)
+
+
+def iter_page_texts(pdf_reader):
+    for page in pdf_reader.pages:
+        yield page.extract_text()
@@ -0,0 +1,183 @@
+"""Sentence segmentation for extracted PDF pages.
+
+Pages are segmented independently, in batches on a process pool, and the
+sentence that runs over a page break is stitched back together afterwards.
+Two backends are available:
+
+- 'regex' (default): a compiled splitter tuned for SEC form text. It does
+  not break after abbreviations, initials or short list markers such as
+  "Item 1." or "(a)".
+- 'punkt': the NLTK punkt model TextBlob uses, loaded once per process.
+
+Compare a backend with TextBlob on a PDF with:
+    python -m pdf_wizard.segmenter form10.pdf [regex|punkt]
+"""
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+SEGMENTER = os.getenv('SEGMENTER', 'regex')
+SEGMENT_WORKERS = int(os.getenv('SEGMENT_WORKERS', str(min(4, os.cpu_count() or 1))))
+PAGES_PER_BATCH = 8
+
+# Sentence-final punctuation, optional closing quotes/brackets, whitespace,
+# then something that can start a sentence.
+_BOUNDARY = re.compile(r'[.?!][\'")\]]*(?=\s+(?:["\'\[]?[A-Z0-9]|\([a-zA-Z0-9]))')
+_TERMINAL = re.compile(r'[.?!][\'")\]]*\s*$')
+_INITIALS = re.compile(r'(?:[A-Za-z]\.)+$')
+_LIST_MARKER = re.compile(r'\(?(?:\d{1,2}|[a-zA-Z]|[ivxIVX]{1,4})[.)]$')
+ABBREVIATIONS = {
+    'no.', 'nos.', 'inc.', 'corp.', 'co.', 'ltd.', 'llc.', 'l.p.', 'u.s.', 'e.g.', 'i.e.',
+    'etc.', 'vs.', 'mr.', 'mrs.', 'ms.', 'dr.', 'jr.', 'sr.', 'st.', 'sec.', 'secs.',
+    'art.', 'para.', 'pp.', 'p.', 'approx.', 'jan.', 'feb.', 'mar.', 'apr.', 'jun.',
+    'jul.', 'aug.', 'sep.', 'sept.', 'oct.', 'nov.', 'dec.', 'fig.', 'cf.', 'al.',
+    'reg.', 'stat.', 'cfr.', 'seq.', 'ch.', 'vol.', 'op.',
+}
+
+
+def _regex_spans(text):
+    spans = []
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        end = match.end()
+        word = text[text.rfind(' ', start, match.start()) + 1:match.start() + 1]
+        word = word.split('\n')[-1]
+        if (word.lower() in ABBREVIATIONS or _INITIALS.match(word)
+                or _LIST_MARKER.fullmatch(word)):
+            continue
+        spans.append((start, end))
+        start = end
+    spans.append((start, len(text)))
+    return spans
+
+
+@lru_cache(maxsize=None)
+def _punkt():
+    import nltk
+    nltk.download('punkt', quiet=True)
+    return nltk.data.load('tokenizers/punkt/english.pickle')
+
+
+def _punkt_spans(text):
+    return list(_punkt().span_tokenize(text))
+
+
+def sentence_spans(text, backend=SEGMENTER):
+    """Return (start, end) spans of the sentences in text, whitespace trimmed."""
+    spans = _punkt_spans(text) if backend == 'punkt' else _regex_spans(text)
+    trimmed = []
+    for start, end in spans:
+        piece = text[start:end]
+        stripped = piece.strip()
+        if stripped:
+            start += len(piece) - len(piece.lstrip())
+            trimmed.append((start, start + len(stripped)))
+    return trimmed
+
+
+def segment_batch(pages, backend=SEGMENTER):
+    return [sentence_spans(text, backend) for text in pages]
+
+
+def _iter_batches(pages, size):
+    batch = []
+    for text in pages:
+        batch.append(text)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iter_segmented(pages, backend, workers, pages_per_batch):
+    """Yield (page text, spans) in page order."""
+    batches = _iter_batches(pages, pages_per_batch)
+    if workers <= 1:
+        for batch in batches:
+            yield from zip(batch, segment_batch(batch, backend))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded number of batches in flight so memory stays flat
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(segment_batch, batch, backend)))
+            if len(pending) >= 2 * workers:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+
+def iter_sentences(pages, backend=SEGMENTER, workers=SEGMENT_WORKERS, pages_per_batch=PAGES_PER_BATCH):
+    """Split a stream of page texts into sentences.
+
+    A page's last sentence without final punctuation is joined with the
+    first sentence of the next page, as if the pages had been concatenated.
+    """
+    carry = ''
+    for text, spans in _iter_segmented(pages, backend, workers, pages_per_batch):
+        if not spans:
+            carry += text
+            continue
+        if carry.strip() and not _TERMINAL.search(carry):
+            # The sentence continues on this page
+            shift = len(carry)
+            text = carry + text
+            spans = [(0, spans[0][1] + shift)] + [(s + shift, e + shift) for s, e in spans[1:]]
+        elif carry.strip():
+            yield carry.strip()
+        for start, end in spans[:-1]:
+            yield text[start:end]
+        carry = text[spans[-1][0]:]
+    if carry.strip():
+        yield carry.strip()
+
+
+def textblob_sentences(text):
+    from textblob import TextBlob
+    return [sentence.raw for sentence in TextBlob(text).sentences]
+
+
+def compare_with_textblob(pages, backend=SEGMENTER):
+    """Time a backend against TextBlob on the joined pages and report how many
+    TextBlob sentence boundaries it reproduces."""
+    text = ''.join(pages)
+    started = time.perf_counter()
+    reference = textblob_sentences(text)
+    textblob_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    sentences = list(iter_sentences(pages, backend))
+    seconds = time.perf_counter() - started
+
+    def boundaries(sentence_list):
+        ends, offset = set(), 0
+        for sentence in sentence_list:
+            offset = text.index(sentence, offset) + len(sentence)
+            ends.add(offset)
+        return ends
+
+    expected = boundaries(reference)
+    found = boundaries(sentences)
+    agreed = len(expected & found)
+    return {
+        'textblob_seconds': textblob_seconds,
+        'seconds': seconds,
+        'speedup': textblob_seconds / seconds if seconds else float('inf'),
+        'textblob_sentences': len(reference),
+        'sentences': len(sentences),
+        'precision': agreed / len(found) if found else 1.0,
+        'recall': agreed / len(expected) if expected else 1.0,
+    }
+
+
+if __name__ == '__main__':
+    import PyPDF2
+    with open(sys.argv[1], 'rb') as f:
+        pages = [page.extract_text() for page in PyPDF2.PdfReader(f).pages]
+    print(compare_with_textblob(pages, sys.argv[2] if len(sys.argv) > 2 else SEGMENTER))
@@ -0,0 +1,138 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Pinecone rejects upsert requests over 2MB and 1000 vectors
+MAX_BATCH_BYTES = 2 * 1024 * 1024 - 64 * 1024
+MAX_BATCH_VECTORS = 1000
+UPSERT_WORKERS = 4
+# IDs per fetch request, they are sent in the query string
+FETCH_BATCH = 100
+# Serialized size of one float in a JSON request, plus fixed per-vector overhead
+BYTES_PER_VALUE = 12
+VECTOR_OVERHEAD = 96
+METADATA_COLUMNS = ['Filename', 'Text', 'Metadata']
+
+
+def payload_sizes(ids, embeddings, df):
+    """Estimate the serialized size of every vector, metadata included."""
+    sizes = np.full(len(df), VECTOR_OVERHEAD + embeddings.shape[1] * BYTES_PER_VALUE, dtype=np.int64)
+    sizes += np.fromiter((len(i) for i in ids), dtype=np.int64, count=len(ids))
+    for column in METADATA_COLUMNS:
+        sizes += np.fromiter((len(str(v).encode('utf-8')) for v in df[column]), dtype=np.int64, count=len(df))
+    return sizes
+
+
+def batch_bounds(sizes, max_bytes=MAX_BATCH_BYTES, max_vectors=MAX_BATCH_VECTORS):
+    """Split rows into consecutive [start, end) ranges under both limits."""
+    cumulative = np.concatenate([[0], np.cumsum(sizes)])
+    bounds = []
+    start = 0
+    while start < len(sizes):
+        # Last row that still fits, always taking at least one row
+        end = int(np.searchsorted(cumulative, cumulative[start] + max_bytes, side='right')) - 1
+        end = min(max(end, start + 1), start + max_vectors, len(sizes))
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def _upsert(index, vectors, retries):
+    for attempt in range(retries + 1):
+        try:
+            response = index.upsert(vectors=vectors)
+            upserted = getattr(response, 'upserted_count', None)
+            if upserted is None and isinstance(response, dict):
+                upserted = response.get('upserted_count')
+            # Upserts are idempotent, so a partially applied batch is resent whole
+            if upserted is None or upserted >= len(vectors):
+                return len(vectors)
+            print(f"Upsert stored {upserted} of {len(vectors)} vectors, retrying")
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print("Upsert failed, retrying:", str(e))
+        time.sleep(min(2 ** attempt, 30))
+    raise RuntimeError(f"Upsert of {len(vectors)} vectors did not complete after {retries + 1} attempts")
+
+
+def upsert_frame(index, ids, embeddings, df, max_bytes=MAX_BATCH_BYTES,
+                 max_vectors=MAX_BATCH_VECTORS, workers=UPSERT_WORKERS, retries=3):
+    """Upsert rows of df (Filename, Text, Metadata) with their embeddings.
+
+    Batches are sized by estimated payload bytes and several are kept in
+    flight on a thread pool. index is anything with a pinecone-style
+    upsert(vectors=...) method. Returns the number of vectors upserted.
+    """
+    if not len(df):
+        return 0
+    ids = [str(i) for i in ids]
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    metadata = df[METADATA_COLUMNS].reset_index(drop=True)
+    bounds = batch_bounds(payload_sizes(ids, embeddings, metadata), max_bytes, max_vectors)
+    upserted = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start, end in bounds:
+            vectors = list(zip(ids[start:end], embeddings[start:end].tolist(),
+                               metadata.iloc[start:end].to_dict('records')))
+            pending.append(pool.submit(_upsert, index, vectors, retries))
+            # Bound the number of built batches waiting for a worker
+            if len(pending) >= 2 * workers:
+                upserted += pending.popleft().result()
+        while pending:
+            upserted += pending.popleft().result()
+    return upserted
+
+
+def count_stored(index, ids):
+    """How many of ids are in the index."""
+    return sum(len(index.fetch(ids=ids[i:i + FETCH_BATCH])['vectors']) for i in range(0, len(ids), FETCH_BATCH))
+
+
+def _delete(index, ids, retries):
+    # Deletes report nothing back, so count what is there to remove first
+    stored = count_stored(index, ids)
+    for attempt in range(retries + 1):
+        try:
+            index.delete(ids=ids)
+            return stored
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print("Delete failed, retrying:", str(e))
+        time.sleep(min(2 ** attempt, 30))
+
+
+def delete_ids(index, ids, max_vectors=MAX_BATCH_VECTORS, workers=UPSERT_WORKERS, retries=3):
+    """Delete known vector IDs in batches, returns the number of vectors removed."""
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    batches = [ids[i:i + max_vectors] for i in range(0, len(ids), max_vectors)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda batch: _delete(index, batch, retries), batches))
+
+
+def delete_by_filter_query(index, filename, dimension=1536, top_k=10000):
+    """Fallback for documents ingested before their IDs were recorded.
+
+    Queries with the Filename filter and deletes what comes back until
+    nothing is left, so documents over top_k chunks are removed too.
+    """
+    deleted = set()
+    waits = 0
+    while True:
+        results = index.query(vector=np.random.rand(dimension).tolist(), top_k=top_k,
+                              include_values=False, filter={"Filename": {"$eq": filename}})
+        ids = [match['id'] for match in results['matches'] if match['id'] not in deleted]
+        if not ids:
+            # Deletes are eventually consistent, give already deleted IDs time to drop out
+            if not results['matches'] or waits == 3:
+                return len(deleted)
+            waits += 1
+            time.sleep(1)
+            continue
+        delete_ids(index, ids)
+        deleted.update(ids)
+        waits = 0
@@ -0,0 +1,322 @@
+"""In-process vector index usable in place of pinecone.Index.
+
+Anything with the pinecone.Index methods this project calls (upsert, query,
+delete, fetch, describe_index_stats) can serve as the vector store.
+LocalIndex implements them over a contiguous float32 matrix:
+
+- exact top-k is one matrix-vector product plus argpartition,
+- with n_lists > 0 an IVF (inverted file) mode only scores the rows in the
+  n_probe clusters closest to the query, for large corpora,
+- metadata filters support the Pinecone operators $eq, $ne, $in, $nin,
+  $gt, $gte, $lt, $lte, $and and $or,
+- with a path, flush() persists the index and a restarted process maps
+  the vectors back in without reading them into memory.
+
+Set VECTOR_STORE=local (and optionally VECTOR_STORE_PATH) to use it.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+VECTOR_STORE = os.getenv('VECTOR_STORE', 'pinecone')
+VECTOR_STORE_PATH = os.getenv('VECTOR_STORE_PATH', 'vector_store')
+VECTOR_STORE_LISTS = int(os.getenv('VECTOR_STORE_LISTS', '0'))
+EMBEDDING_DIM = 1536
+
+
+def _compare(op, value, target):
+    if value is None:
+        return op in ('$ne', '$nin')
+    if op == '$eq':
+        return value == target
+    if op == '$ne':
+        return value != target
+    if op == '$in':
+        return value in target
+    if op == '$nin':
+        return value not in target
+    if op == '$gt':
+        return value > target
+    if op == '$gte':
+        return value >= target
+    if op == '$lt':
+        return value < target
+    if op == '$lte':
+        return value <= target
+    raise ValueError(f"Unsupported filter operator {op}")
+
+
+def matches_filter(metadata, filter):
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(matches_filter(metadata, f) for f in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_filter(metadata, f) for f in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not all(_compare(op, metadata.get(key), target) for op, target in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class LocalIndex:
+    def __init__(self, path=None, dimension=EMBEDDING_DIM, metric='cosine', n_lists=0, n_probe=8):
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.lock = threading.RLock()
+        self._clear()
+        self._loaded_mtime = None
+        if path and os.path.exists(os.path.join(path, 'ids.json')):
+            self._load()
+
+    def _clear(self):
+        self.vectors = np.empty((0, self.dimension), dtype=np.float32)
+        self.count = 0
+        self.ids = []
+        self.metadata = []
+        self.rows = {}
+        self.centroids = None
+        self.assign = np.empty(0, dtype=np.int32)
+        self.dirty = False
+
+    # Storage
+
+    def _reserve(self, n):
+        if n <= len(self.vectors):
+            return
+        capacity = max(n, 2 * len(self.vectors), 1024)
+        vectors = np.empty((capacity, self.dimension), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:self.count] = self.assign[:self.count]
+        self.vectors, self.assign = vectors, assign
+
+    def _prepare(self, values):
+        values = np.asarray(values, dtype=np.float32).reshape(-1, self.dimension)
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(values, axis=1, keepdims=True)
+            values = values / np.where(norms == 0, 1, norms)
+        return values
+
+    def _nearest_list(self, values):
+        return np.argmax(values @ self.centroids.T, axis=1).astype(np.int32)
+
+    def upsert(self, vectors, namespace=''):
+        ids, values, metadata = [], [], []
+        for vector in vectors:
+            if isinstance(vector, dict):
+                ids.append(str(vector['id']))
+                values.append(vector['values'])
+                metadata.append(vector.get('metadata') or {})
+            else:
+                ids.append(str(vector[0]))
+                values.append(vector[1])
+                metadata.append(vector[2] if len(vector) > 2 and vector[2] else {})
+        values = self._prepare(values)
+        with self.lock:
+            self._reserve(self.count + len(ids))
+            for vector_id, value, meta in zip(ids, values, metadata):
+                row = self.rows.get(vector_id)
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self.rows[vector_id] = row
+                    self.ids.append(vector_id)
+                    self.metadata.append(meta)
+                else:
+                    self.metadata[row] = meta
+                self.vectors[row] = value
+                if self.centroids is not None:
+                    self.assign[row] = self._nearest_list(value[None, :])[0]
+            self.dirty = True
+        return {'upserted_count': len(ids)}
+
+    def _remove_row(self, row):
+        # Move the last row into the hole so the matrix stays contiguous
+        last = self.count - 1
+        del self.rows[self.ids[row]]
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.assign[row] = self.assign[last]
+            self.ids[row] = self.ids[last]
+            self.metadata[row] = self.metadata[last]
+            self.rows[self.ids[row]] = row
+        self.ids.pop()
+        self.metadata.pop()
+        self.count = last
+
+    def delete(self, ids=None, delete_all=False, filter=None, namespace=''):
+        with self.lock:
+            if delete_all:
+                self._clear()
+                self.dirty = True
+                return {}
+            rows = set()
+            if ids:
+                rows.update(self.rows[str(i)] for i in ids if str(i) in self.rows)
+            if filter:
+                rows.update(r for r in range(self.count) if matches_filter(self.metadata[r], filter))
+            # Highest rows first so swapped-in rows are never ones still to delete
+            for row in sorted(rows, reverse=True):
+                self._remove_row(row)
+            self.dirty = self.dirty or bool(rows)
+        return {}
+
+    def fetch(self, ids, namespace=''):
+        with self.lock:
+            vectors = {}
+            for vector_id in ids:
+                row = self.rows.get(str(vector_id))
+                if row is not None:
+                    vectors[vector_id] = {'id': vector_id, 'values': self.vectors[row].tolist(),
+                                          'metadata': self.metadata[row]}
+        return {'vectors': vectors, 'namespace': namespace}
+
+    def describe_index_stats(self):
+        with self.lock:
+            return {'dimension': self.dimension, 'total_vector_count': self.count,
+                    'namespaces': {'': {'vector_count': self.count}}}
+
+    # Search
+
+    def train(self, iterations=10, seed=0):
+        """Cluster the stored vectors into n_lists lists for approximate search."""
+        with self.lock:
+            n_lists = min(self.n_lists, self.count)
+            if n_lists == 0:
+                return
+            rng = np.random.default_rng(seed)
+            data = self.vectors[:self.count]
+            sample = data[rng.choice(self.count, size=min(self.count, n_lists * 256), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                nearest = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = sample[nearest == c]
+                    if len(members):
+                        centroid = members.mean(axis=0)
+                        centroids[c] = centroid / (np.linalg.norm(centroid) or 1)
+            self.centroids = centroids
+            self.assign[:self.count] = self._nearest_list(data)
+            self.dirty = True
+
+    def query(self, vector=None, top_k=10, include_values=False, include_metadata=False,
+              filter=None, namespace='', **kwargs):
+        self.refresh()
+        q = self._prepare(vector)[0]
+        with self.lock:
+            if self.n_lists and self.centroids is None and self.count >= 4 * self.n_lists:
+                self.train()
+            candidates = None
+            if self.centroids is not None:
+                probe = _top_k(self.centroids @ q, self.n_probe)
+                candidates = np.flatnonzero(np.isin(self.assign[:self.count], probe))
+            if filter:
+                rows = range(self.count) if candidates is None else candidates
+                candidates = np.fromiter((r for r in rows if matches_filter(self.metadata[r], filter)),
+                                         dtype=np.int64)
+            if candidates is None:
+                data = self.vectors[:self.count]
+            else:
+                data = self.vectors[candidates]
+            if self.metric == 'euclidean':
+                scores = -np.sum((data - q) ** 2, axis=1)
+            else:
+                scores = data @ q
+            top = _top_k(scores, top_k)
+            rows = top if candidates is None else candidates[top]
+            matches = []
+            for row, score in zip(rows, scores[top]):
+                match = {'id': self.ids[row], 'score': float(score)}
+                if include_values:
+                    match['values'] = self.vectors[row].tolist()
+                if include_metadata:
+                    match['metadata'] = self.metadata[row]
+                matches.append(match)
+        return {'matches': matches, 'namespace': namespace}
+
+    # Persistence
+
+    def _files(self):
+        return {name: os.path.join(self.path, name)
+                for name in ('vectors.npy', 'assign.npy', 'centroids.npy', 'ids.json')}
+
+    def flush(self):
+        """Write the index to path if it changed since the last flush or load."""
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            files = self._files()
+            np.save(files['vectors.npy'] + '.tmp.npy', self.vectors[:self.count])
+            np.save(files['assign.npy'] + '.tmp.npy', self.assign[:self.count])
+            if self.centroids is not None:
+                np.save(files['centroids.npy'] + '.tmp.npy', self.centroids)
+            os.replace(files['vectors.npy'] + '.tmp.npy', files['vectors.npy'])
+            os.replace(files['assign.npy'] + '.tmp.npy', files['assign.npy'])
+            if self.centroids is not None:
+                os.replace(files['centroids.npy'] + '.tmp.npy', files['centroids.npy'])
+            # ids.json is written last, readers reload when it changes
+            with open(files['ids.json'] + '.tmp', 'w') as f:
+                json.dump({'ids': self.ids, 'metadata': self.metadata, 'metric': self.metric}, f)
+            os.replace(files['ids.json'] + '.tmp', files['ids.json'])
+            self._loaded_mtime = os.path.getmtime(files['ids.json'])
+            self.dirty = False
+
+    def _load(self):
+        files = self._files()
+        self._loaded_mtime = os.path.getmtime(files['ids.json'])
+        with open(files['ids.json']) as f:
+            state = json.load(f)
+        # Copy-on-write mapping: pages are read lazily and writes stay private
+        vectors = np.load(files['vectors.npy'], mmap_mode='c')
+        self.ids = state['ids']
+        self.metadata = state['metadata']
+        self.metric = state.get('metric', self.metric)
+        self.rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        self.vectors = vectors
+        self.count = len(self.ids)
+        self.dimension = vectors.shape[1] if vectors.ndim == 2 else self.dimension
+        self.assign = np.array(np.load(files['assign.npy']), dtype=np.int32)
+        if os.path.exists(files['centroids.npy']):
+            self.centroids = np.load(files['centroids.npy'])
+        self.dirty = False
+
+    def refresh(self):
+        """Reload if another process flushed a newer version of the index."""
+        if not self.path:
+            return
+        ids_file = os.path.join(self.path, 'ids.json')
+        with self.lock:
+            if self.dirty or not os.path.exists(ids_file):
+                return
+            if os.path.getmtime(ids_file) != self._loaded_mtime:
+                self._load()
+
+
+def open_local_index(path=VECTOR_STORE_PATH, n_lists=VECTOR_STORE_LISTS):
+    return LocalIndex(path=path, n_lists=n_lists)
+
+
+def flush(index):
+    # Pinecone persists on its own, only the local backend needs this
+    if hasattr(index, 'flush'):
+        index.flush()
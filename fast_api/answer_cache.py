@@ -0,0 +1,98 @@
+import hashlib
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '5000'))
+# Minimum cosine similarity between two questions for one to get the other's
+# answer. ada-002 scores unrelated short questions about the same form well
+# above 0.9 ("filing fee" vs "filing deadline" can reach 0.95), so only
+# rephrasings of the same question should clear it. Lower it for more hits
+# at the risk of answering a different question
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.98'))
+
+
+def context_key(filename, matches):
+    """Bucket for answers built from one set of retrieved chunks.
+
+    The chunks' text hash is part of the key, so re-ingesting a document
+    with different text, or deleting it so its chunks are no longer
+    retrieved, stops old answers from being served.
+    """
+    digest = hashlib.sha256()
+    for match in matches:
+        digest.update(match.get('metadata', {}).get('Text', '').encode('utf-8'))
+        digest.update(b'\0')
+    return (filename, tuple(match['id'] for match in matches), digest.hexdigest())
+
+
+class SemanticAnswerCache:
+    """Answers keyed by retrieved context and looked up by query similarity.
+
+    A cached answer is reused when it was built from the same context and
+    its question embedding has cosine similarity >= threshold with the new
+    one. Least recently used answers are evicted beyond maxsize.
+    """
+
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.entries = OrderedDict()   # entry id -> (key, documents, embedding, answer)
+        self.buckets = {}              # key -> entry ids
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _normalize(self, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1)
+
+    def get(self, key, embedding):
+        query = self._normalize(embedding)
+        with self.lock:
+            entry_ids = self.buckets.get(key)
+            if entry_ids:
+                vectors = np.stack([self.entries[i][2] for i in entry_ids])
+                scores = vectors @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id = entry_ids[best]
+                    self.entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return self.entries[entry_id][3]
+            self.misses += 1
+        return None
+
+    def put(self, key, documents, embedding, answer):
+        """documents are the source files of the context, used for invalidation."""
+        with self.lock:
+            entry_id = next(self.ids)
+            self.entries[entry_id] = (key, set(documents), self._normalize(embedding), answer)
+            self.buckets.setdefault(key, []).append(entry_id)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, entry_id):
+        key = self.entries.pop(entry_id)[0]
+        self.buckets[key].remove(entry_id)
+        if not self.buckets[key]:
+            del self.buckets[key]
+
+    def invalidate(self, filename=None):
+        """Drop answers whose context came from filename, or everything."""
+        with self.lock:
+            stale = [entry_id for entry_id, (key, documents, _, _) in self.entries.items()
+                     if filename is None or filename in documents or key[0] == filename]
+            for entry_id in stale:
+                self._drop(entry_id)
+        return len(stale)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
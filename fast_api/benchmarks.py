@@ -0,0 +1,95 @@
+"""Benchmarks of the service's own overhead, kept out of the modules it runs.
+
+Usage:
+    python benchmarks.py pool [n]          user lookups, fresh connection vs pooled
+    python benchmarks.py login-storm [n]   n concurrent /token requests
+"""
+import asyncio
+import os
+import sys
+import time
+
+# The login storm needs no database. Point RDS_* at a local Postgres for the
+# pool benchmark, it only reads
+os.environ.setdefault('RDS_HOST', '127.0.0.1')
+os.environ.setdefault('RDS_PORT', '5432')
+os.environ.setdefault('RDS_DB_NAME', 'benchmark')
+os.environ.setdefault('RDS_USER', 'benchmark')
+os.environ.setdefault('RDS_PASSWORD', 'benchmark')
+
+import httpx
+import psycopg2
+
+import database as db
+import fast_api as api
+
+
+def pool(requests):
+    """Per-request latency of a user lookup, fresh connection vs pooled."""
+    query = "SELECT username, email, logs FROM users WHERE username=%s;"
+    start = time.perf_counter()
+    for _ in range(requests):
+        conn = psycopg2.connect(db.DATABASE_URL)
+        with conn.cursor() as cur:
+            cur.execute(query, ('benchmark',))
+            cur.fetchone()
+        conn.close()
+    unpooled = (time.perf_counter() - start) / requests
+    start = time.perf_counter()
+    for _ in range(requests):
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, ('benchmark',))
+                cur.fetchone()
+    pooled = (time.perf_counter() - start) / requests
+    print(f"unpooled {unpooled * 1000:.2f} ms/request, pooled {pooled * 1000:.2f} ms/request")
+
+
+def login_storm(logins):
+    """Send logins concurrent /token requests through the app, and track how
+    long the event loop stalls meanwhile.
+
+    The stored password lookup is stubbed with a random password, so no
+    account is created and only the bcrypt work is measured.
+    """
+    username = 'benchmark'
+    password = os.urandom(16).hex()
+    stored_password = db.get_password_hash(password)
+    db.get_stored_password = lambda name: stored_password if name == username else None
+    form = {'username': username, 'password': password}
+
+    async def storm():
+        stalls = []
+        done = asyncio.Event()
+
+        async def probe():
+            # A blocked event loop shows up as a late wake-up
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                stalls.append(time.perf_counter() - start - 0.001)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url='http://benchmark') as client:
+            start = time.perf_counter()
+            (await client.post('/token', data=form)).raise_for_status()
+            single = time.perf_counter() - start
+            prober = asyncio.create_task(probe())
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[client.post('/token', data=form) for _ in range(logins)])
+            elapsed = time.perf_counter() - start
+            done.set()
+            await prober
+        for response in responses:
+            response.raise_for_status()
+        print(f"{logins} concurrent logins in {elapsed:.2f} s, {single * logins:.2f} s if serialized "
+              f"({api.CREDENTIAL_WORKERS} credential workers), event loop stalled at most {max(stalls) * 1000:.1f} ms")
+
+    asyncio.run(storm())
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ['pool']:
+    pool(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+elif __name__ == '__main__' and sys.argv[1:2] == ['login-storm']:
+    login_storm(int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+elif __name__ == '__main__':
+    print(__doc__)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+import numpy as np
+
+from pdf_wizard.chunking import get_encoding
+
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '8'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+# 1.0 ranks purely by relevance, lower values favour chunks unlike those already picked
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+SEPARATOR = "\n\n---\n\n"
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def mmr_order(query, vectors, lambda_=MMR_LAMBDA):
+    """Order candidates by maximal marginal relevance to the query."""
+    if len(vectors) == 0:
+        return []
+    vectors = _unit(vectors)
+    relevance = vectors @ _unit(query)
+    similarity = vectors @ vectors.T
+    order = [int(np.argmax(relevance))]
+    redundancy = similarity[order[0]].copy()
+    remaining = set(range(len(vectors))) - set(order)
+    while remaining:
+        candidates = np.array(sorted(remaining))
+        scores = lambda_ * relevance[candidates] - (1 - lambda_) * redundancy[candidates]
+        best = int(candidates[np.argmax(scores)])
+        order.append(best)
+        remaining.discard(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+
+
+def best_window(tokens, encoding, question, size):
+    """The size-token window of a chunk sharing the most words with the question."""
+    words = set(question.lower().split())
+    last = max(len(tokens) - size, 0)
+    best, best_score = 0, -1
+    for start in [*range(0, last, max(size // 2, 1)), last]:
+        text = encoding.decode(tokens[start:start + size]).lower()
+        score = sum(word in text for word in words)
+        if score > best_score:
+            best, best_score = start, score
+    return tokens[best:best + size]
+
+
+def pack_context(matches, query, budget=CONTEXT_TOKEN_BUDGET, question=''):
+    """Pick matches in MMR order and fit their texts into budget tokens.
+
+    Chunks with identical text are kept once, and a chunk that does not fit
+    the remaining budget is skipped for the next one. If not even the first
+    chunk fits, its window most relevant to the question is used instead.
+    Returns (selected matches, context text, context tokens).
+    """
+    seen = set()
+    unique = []
+    for match in matches:
+        text = match['metadata'].get('Text', '')
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        if text and digest not in seen:
+            seen.add(digest)
+            unique.append(match)
+    if not unique:
+        return [], '', 0
+    if all(match.get('values') for match in unique):
+        unique = [unique[i] for i in mmr_order(query, [match['values'] for match in unique])]
+
+    encoding = get_encoding()
+    separator_tokens = len(encoding.encode(SEPARATOR))
+    selected, texts, used = [], [], 0
+    for match in unique:
+        tokens = encoding.encode(match['metadata']['Text'])
+        cost = len(tokens) + (separator_tokens if texts else 0)
+        if used + cost > budget:
+            continue
+        selected.append(match)
+        texts.append(match['metadata']['Text'])
+        used += cost
+    if not selected:
+        tokens = best_window(encoding.encode(unique[0]['metadata']['Text']), encoding, question, budget)
+        return [unique[0]], encoding.decode(tokens), len(tokens)
+    return selected, SEPARATOR.join(texts), used
@@ -1,5 +1,15 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 from passlib.context import CryptContext
+from contextlib import contextmanager
+from functools import lru_cache
+import user_cache
+import threading
+import time
+import sys
 import os
 
 RDS_HOST = os.environ['RDS_HOST']
@@ -10,163 +20,432 @@ RDS_PASSWORD = os.environ['RDS_PASSWORD']
 DATABASE_URL = f"dbname='{RDS_DB_NAME}' user='{RDS_USER}' host='{RDS_HOST}' port={RDS_PORT} password='{RDS_PASSWORD}'"
 # psql --host=assignment-3.cg4vo6ofeasg.us-east-1.rds.amazonaws.com --port=5432 --username=postgres --password --dbname=a3 
 
-def get_connection():
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+# Connections idle longer than this are pinged before being handed out
+DB_POOL_CHECK_AFTER = float(os.getenv('DB_POOL_CHECK_AFTER', '30'))
+# Seconds to wait for a free connection once all DB_POOL_MAX are checked out
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+pool = None
+pool_lock = threading.Lock()
+last_used = {}
+# psycopg2's pool raises when exhausted, callers queue here instead
+pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool is None:
+            try:
+                pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+            except psycopg2.Error as e:
+                print("Unable to connect to the database")
+                print(e)
+        return pool
+
+
+def is_healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - last_used.get(id(conn), 0) < DB_POOL_CHECK_AFTER:
+        return True
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except psycopg2.Error as e:
-        print("Unable to connect to the database")
-        print(e)
-        return None
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
-def setup_database():
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
+
+def checkout(pool):
+    # A connection the server dropped is replaced, not handed out
+    for _ in range(DB_POOL_MAX + 1):
+        conn = pool.getconn()
+        if is_healthy(conn):
+            return conn
+        last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("No healthy database connection")
+
+
+@contextmanager
+def connection():
+    """Check out a pooled connection for one request, yields None if the
+    database is unreachable. The connection goes back to the pool on exit."""
+    pool = get_pool()
+    if pool is None:
+        yield None
+        return
+    if not pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        print("Timed out waiting for a database connection")
+        yield None
+        return
+    try:
         try:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    logs VARCHAR(255) DEFAULT NULL
-                );
-            """)
-            conn.commit()
+            conn = checkout(pool)
         except psycopg2.Error as e:
-            print("Failed to create the 'users' table.")
+            print("Unable to connect to the database")
             print(e)
-            conn.rollback()
+            yield None
+            return
+        try:
+            yield conn
         finally:
-            cur.close()
-            conn.close()
+            if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+            if conn.closed:
+                last_used.pop(id(conn), None)
+            else:
+                last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        pool_slots.release()
+
+def setup_database():
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        id SERIAL PRIMARY KEY,
+                        username VARCHAR(255) UNIQUE NOT NULL,
+                        email VARCHAR(255) UNIQUE NOT NULL,
+                        password VARCHAR(255) NOT NULL,
+                        logs VARCHAR(255) DEFAULT NULL
+                    );
+                """)
+                # One row per question and answer, only ever appended to
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS chat_messages (
+                        id BIGSERIAL PRIMARY KEY,
+                        username VARCHAR(255) NOT NULL,
+                        filename TEXT,
+                        question TEXT NOT NULL,
+                        answer TEXT NOT NULL,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    );
+                    CREATE INDEX IF NOT EXISTS chat_messages_username_id ON chat_messages (username, id);
+                """)
+                # One row per ingested document, written in place by filename
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS documents (
+                        filename TEXT PRIMARY KEY,
+                        chunk_count INTEGER NOT NULL DEFAULT 0,
+                        first_id TEXT,
+                        last_id TEXT,
+                        vector_ids TEXT[],
+                        status VARCHAR(32) NOT NULL,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    );
+                """)
+                conn.commit()
+            except psycopg2.Error as e:
+                print("Failed to create the tables.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def add_user(username, email, password, path):
-    hashed_password = get_password_hash(password)  # Hash the password
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("INSERT INTO users (username, email, password, logs) VALUES (%s, %s, %s, %s);", (username, email, hashed_password, path))
-            conn.commit()
-        except psycopg2.Error as e:
-            print("Failed to add user.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+def add_user(username, email, hashed_password, path):
+    """Insert a user in one round trip, the unique constraints catch taken names.
+
+    Returns "created", "username" or "email" for the column already taken,
+    or None if the insert failed for another reason.
+    """
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("INSERT INTO users (username, email, password, logs) VALUES (%s, %s, %s, %s);", (username, email, hashed_password, path))
+                conn.commit()
+                return "created"
+            except psycopg2.errors.UniqueViolation as e:
+                conn.rollback()
+                return "email" if e.diag.constraint_name == "users_email_key" else "username"
+            except psycopg2.Error as e:
+                print("Failed to add user.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return None
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+@lru_cache(maxsize=None)
+def missing_user_hash():
+    return get_password_hash(os.urandom(16).hex())
+
+def verify_against(plain_password, stored_password):
+    """Check a login against the stored hash, None for an unknown user.
+
+    An unknown user is checked against a dummy hash so both cases take as
+    long. Run it on a worker thread, the dummy hash is bcrypt too.
+    """
+    valid = verify_password(plain_password, stored_password or missing_user_hash())
+    return bool(stored_password) and valid
+
+def get_stored_password(username):
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT password FROM users WHERE username=%s;", (username,))
+                user = cur.fetchone()
+                if user:
+                    return user[0]
+            except psycopg2.Error as e:
+                print("Error checking user.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return None
+
 def check_user(username, password):
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT username, password FROM users WHERE username=%s;", (username,))
-            user = cur.fetchone()
-            if user:
-                stored_password = user[1]
-                return verify_password(password, stored_password)
-        except psycopg2.Error as e:
-            print("Error checking user.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+    # The connection is back in the pool before bcrypt runs
+    stored_password = get_stored_password(username)
+    if stored_password:
+        return verify_password(password, stored_password)
     return False
 
 
 def user_exists(username):
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT username FROM users WHERE username=%s;", (username,))
-            user = cur.fetchone()
-            return bool(user)
-        except psycopg2.Error as e:
-            print("Error checking if user exists.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT username FROM users WHERE username=%s;", (username,))
+                user = cur.fetchone()
+                return bool(user)
+            except psycopg2.Error as e:
+                print("Error checking if user exists.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
     return False
 
 def email_exists(username):
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT email FROM users WHERE email=%s;", (username,))
-            user = cur.fetchone()
-            return bool(user)
-        except psycopg2.Error as e:
-            print("Error checking if email exists.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT email FROM users WHERE email=%s;", (username,))
+                user = cur.fetchone()
+                return bool(user)
+            except psycopg2.Error as e:
+                print("Error checking if email exists.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
     return False
 
 
 def update_user_email(username, email):
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("UPDATE users SET email = %s WHERE username = %s;", (email, username))
-            conn.commit()
-        except psycopg2.Error as e:
-            print("Error updating user email.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("UPDATE users SET email = %s WHERE username = %s;", (email, username))
+                conn.commit()
+                user_cache.users.invalidate(username)
+            except psycopg2.Error as e:
+                print("Error updating user email.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
 
 def update_user_password(username, new_password):
     hashed_password = get_password_hash(new_password)
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("UPDATE users SET password = %s WHERE username = %s;", (hashed_password, username))
-            conn.commit()
-        except psycopg2.Error as e:
-            print("Error updating user password.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("UPDATE users SET password = %s WHERE username = %s;", (hashed_password, username))
+                conn.commit()
+                user_cache.users.invalidate(username)
+            except psycopg2.Error as e:
+                print("Error updating user password.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
 
 def email_exists(email):
-    conn = get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT email FROM users WHERE email = %s;", (email,))
-            result = cur.fetchone()
-            return bool(result)
-        except psycopg2.Error as e:
-            print("Error checking if email exists.")
-            print(e)
-            conn.rollback()
-        finally:
-            cur.close()
-            conn.close()
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT email FROM users WHERE email = %s;", (email,))
+                result = cur.fetchone()
+                return bool(result)
+            except psycopg2.Error as e:
+                print("Error checking if email exists.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
     return False
 
 
+def add_chat_messages(username, messages):
+    """Append (filename, question, answer) tuples in one batched insert."""
+    if not messages:
+        return 0
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                psycopg2.extras.execute_values(
+                    cur,
+                    "INSERT INTO chat_messages (username, filename, question, answer) VALUES %s;",
+                    [(username, filename, question, answer) for filename, question, answer in messages]
+                )
+                conn.commit()
+                return len(messages)
+            except psycopg2.Error as e:
+                print("Error adding chat messages.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return 0
+
+def get_chat_messages(username, before=None, limit=50):
+    """Newest first page of a user's messages, older pages follow with before=<smallest id seen>."""
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    SELECT id, filename, question, answer, created_at FROM chat_messages
+                    WHERE username = %s AND (%s::BIGINT IS NULL OR id < %s)
+                    ORDER BY id DESC LIMIT %s;
+                """, (username, before, before, limit))
+                return cur.fetchall()
+            except psycopg2.Error as e:
+                print("Error fetching chat messages.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return []
+
+
+DOCUMENT_COLUMNS = ["filename", "chunk_count", "first_id", "last_id", "status", "created_at", "updated_at"]
+
+def upsert_document(filename, status, chunk_count=None, first_id=None, last_id=None, vector_ids=None):
+    """Insert or update one catalog row, fields left as None keep their value.
+
+    vector_ids is the registry of every vector the document is stored as,
+    so deleting it needs no similarity search.
+    """
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("""
+                    INSERT INTO documents (filename, status, chunk_count, first_id, last_id, vector_ids)
+                    VALUES (%s, %s, COALESCE(%s, 0), %s, %s, %s)
+                    ON CONFLICT (filename) DO UPDATE SET
+                        status = EXCLUDED.status,
+                        chunk_count = COALESCE(%s, documents.chunk_count),
+                        first_id = COALESCE(%s, documents.first_id),
+                        last_id = COALESCE(%s, documents.last_id),
+                        vector_ids = COALESCE(%s, documents.vector_ids),
+                        updated_at = clock_timestamp()
+                    RETURNING filename, chunk_count, first_id, last_id, status, created_at, updated_at;
+                """, (filename, status, chunk_count, first_id, last_id, vector_ids,
+                      chunk_count, first_id, last_id, vector_ids))
+                row = cur.fetchone()
+                conn.commit()
+                return dict(zip(DOCUMENT_COLUMNS, row))
+            except psycopg2.Error as e:
+                print("Error updating document catalog.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return None
+
+def get_document_vector_ids(filename):
+    """Vector IDs registered for a document, None if none were recorded."""
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT vector_ids FROM documents WHERE filename = %s;", (filename,))
+                row = cur.fetchone()
+                return row[0] if row else None
+            except psycopg2.Error as e:
+                print("Error reading document catalog.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return None
+
+def get_catalog_version():
+    """Changes whenever a catalog row is added or updated, used as the ETag."""
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT count(*), max(updated_at) FROM documents;")
+                count, updated_at = cur.fetchone()
+                return f"{count}-{updated_at.timestamp() if updated_at else 0}"
+            except psycopg2.Error as e:
+                print("Error reading document catalog.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return None
+
+def get_documents(include_deleted=False):
+    with connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(f"""
+                    SELECT {", ".join(DOCUMENT_COLUMNS)} FROM documents
+                    WHERE %s OR status <> 'deleted' ORDER BY filename;
+                """, (include_deleted,))
+                return [dict(zip(DOCUMENT_COLUMNS, row)) for row in cur.fetchall()]
+            except psycopg2.Error as e:
+                print("Error reading document catalog.")
+                print(e)
+                conn.rollback()
+            finally:
+                cur.close()
+    return None
+
+
 # Call setup_database to ensure tables are created when script runs
 setup_database()
+
+
+def import_filenames_csv(path):
+    # One-off seeding of the catalog from the old filenames.csv
+    import csv
+    with open(path, newline='') as f:
+        names = [row[0].strip() for row in list(csv.reader(f))[1:] if row]
+    for name in names:
+        upsert_document(name, "ready")
+    print(f"Imported {len(names)} documents")
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ['import-csv']:
+    import_filenames_csv(sys.argv[2])
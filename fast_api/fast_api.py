@@ -1,20 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi import Security
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import database as db
+import user_cache
+from pdf_wizard.chunking import count_tokens
+from pdf_wizard.vector_store import VECTOR_STORE, open_local_index
+from query_cache import QueryEmbeddingCache
+from answer_cache import SemanticAnswerCache, context_key
+from openai_client import OpenAIClient
+from context import RETRIEVAL_TOP_K, pack_context
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import json
 import psycopg2
-import openai
 import pinecone
 import requests
 import re
 import os
 
 
-pinecone.init(api_key=os.environ['PINECONE_API_KEY'], environment='gcp-starter')
-index = pinecone.Index('bigdata')
+if VECTOR_STORE == 'local':
+    index = open_local_index()
+else:
+    pinecone.init(api_key=os.environ['PINECONE_API_KEY'], environment='gcp-starter')
+    index = pinecone.Index('bigdata')
 
 class Token(BaseModel):
     access_token: str
@@ -42,12 +57,33 @@ class QueryModel(BaseModel):
     query: str
     filename: str = None
 
+class BatchQueryModel(BaseModel):
+    items: List[QueryModel]
+
+class ChatMessage(BaseModel):
+    question: str
+    answer: str
+    filename: Optional[str] = None
+
+class ChatHistoryModel(BaseModel):
+    messages: List[ChatMessage]
+
+class DocumentRecord(BaseModel):
+    status: str = "ready"
+    chunk_count: Optional[int] = None
+    first_id: Optional[str] = None
+    last_id: Optional[str] = None
+    vector_ids: Optional[List[str]] = None
+
 class Query(BaseModel):
     query: str
 
 class OpenAIModel(BaseModel):
     api_key: str
 
+class DocumentModel(BaseModel):
+    filename: Optional[str] = None
+
 def construct_prompt(context,query):
     prompt = """Use the below content only to answer the question. If no content is found say No answer\n\n"""
     prompt += "Content: " + context
@@ -59,24 +95,23 @@ def construct_prompt(context,query):
     return prompt
 
 def get_user(username: str):
-    conn = db.get_connection()
-    if conn:
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT username, email, logs FROM users WHERE username=%s;", (username,))
-            user_data = cur.fetchone()
-            if user_data:
-                user_dict = {
-                    "username": user_data[0],
-                    "email": user_data[1],
-                    "logs": user_data[2]
-                }
-                return UserInDB(**user_dict)
-        except psycopg2.Error as e:
-            print("Error fetching user.")
-        finally:
-            cur.close()
-            conn.close()
+    with db.connection() as conn:
+        if conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT username, email, logs FROM users WHERE username=%s;", (username,))
+                user_data = cur.fetchone()
+                if user_data:
+                    user_dict = {
+                        "username": user_data[0],
+                        "email": user_data[1],
+                        "logs": user_data[2]
+                    }
+                    return UserInDB(**user_dict)
+            except psycopg2.Error as e:
+                print("Error fetching user.")
+            finally:
+                cur.close()
     return None
 
 
@@ -84,17 +119,24 @@ def get_user(username: str):
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     # Here, we decode the token. In a real-world scenario, you'd also verify its validity, expiration, etc.
-    try:
-        payload = decode_access_token(token)
-        username: Optional[str] = payload.get("sub")
-        if username is None:
+    # Verified tokens and their users are cached briefly, so most requests skip both
+    payload = user_cache.tokens.get(token)
+    if payload is None:
+        try:
+            payload = decode_access_token(token)
+        except Exception:
             raise credentials_exception
-    except Exception:
+        user_cache.tokens.put(token, payload, payload.get("exp"))
+    username: Optional[str] = payload.get("sub")
+    if username is None:
         raise credentials_exception
 
-    user = get_user(username)
+    user = user_cache.users.get(username)
     if user is None:
-        raise credentials_exception
+        user = await run_in_threadpool(get_user, username)
+        if user is None:
+            raise credentials_exception
+        user_cache.users.put(username, user)
     return user
 
 credentials_exception = HTTPException(
@@ -111,25 +153,35 @@ def is_valid_email(email):
     return re.match(email_pattern, email) is not None
 
 
+# bcrypt is slow on purpose, it runs on its own bounded pool off the event loop
+CREDENTIAL_WORKERS = int(os.getenv('CREDENTIAL_WORKERS', str(os.cpu_count() or 1)))
+credential_pool = ThreadPoolExecutor(max_workers=CREDENTIAL_WORKERS, thread_name_prefix='bcrypt')
+
+
+async def run_credential_task(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(credential_pool, func, *args)
+
+
 @app.post("/register")
 async def register_user(user: User):
-    if db.user_exists(user.username):
-        raise HTTPException(status_code=400, detail="User already exists")
-    if db.email_exists(user.email):
-        raise HTTPException(status_code=401, detail="Email already exists")
     if not is_valid_email(user.email):
         raise HTTPException(status_code=402, detail="Invalid email format")
+    hashed_password = await run_credential_task(db.get_password_hash, user.password)
     logs = ""
-    db.add_user(user.username, user.email, user.password, logs)
+    created = await run_in_threadpool(db.add_user, user.username, user.email, hashed_password, logs)
+    if created == "username":
+        raise HTTPException(status_code=400, detail="User already exists")
+    if created == "email":
+        raise HTTPException(status_code=401, detail="Email already exists")
+    if created is None:
+        raise HTTPException(status_code=500, detail="Could not create user")
     return {"message": "User created successfully"}
 
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    stored_password = db.get_password_hash(form_data.password)  # Get hashed password from database
-    
-    
-    if db.check_user(form_data.username, form_data.password):
+    stored_password = await run_in_threadpool(db.get_stored_password, form_data.username)
+    if await run_credential_task(db.verify_against, form_data.password, stored_password):
         access_token = create_access_token(data={"sub": form_data.username}, expires_delta=None)
         return {"access_token": access_token, "token_type": "bearer"}
     raise credentials_exception
@@ -143,45 +195,290 @@ async def read_users_details(current_user: UserInDB = Depends(get_current_user))
     return current_user
 
 
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '50'))
 
-@app.post("/answer/")
-async def answer_question(query_model: QueryModel, openai_model: OpenAIModel, current_user: UserInDB = Security(get_current_user)):
-    openai.api_key =openai_model.api_key
-    if query_model.filename.lower() == 'all':
-        # Create an embedding of the query
-        xq = openai.Embedding.create(input=query_model.query, engine="text-embedding-ada-002")['data'][0]['embedding']
-        res = index.query(
-            vector=xq,
-            top_k=1,
-            include_metadata=True
-        )
-    else:
-        
-        xq = openai.Embedding.create(input=query_model.query, engine="text-embedding-ada-002")['data'][0]['embedding']
-        res = index.query(
+
+@app.post("/history")
+async def append_history(history: ChatHistoryModel, current_user: UserInDB = Depends(get_current_user)):
+    messages = [(m.filename, m.question, m.answer) for m in history.messages]
+    added = await run_in_threadpool(db.add_chat_messages, current_user.username, messages)
+    if added != len(messages):
+        raise HTTPException(status_code=500, detail="Could not save chat history")
+    return {"added": added}
+
+
+@app.get("/history")
+async def read_history(before: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE, current_user: UserInDB = Depends(get_current_user)):
+    """One page of the user's messages, newest first. Pass next_before as
+    before to get the page of older messages."""
+    limit = max(1, min(limit, HISTORY_PAGE_SIZE))
+    rows = await run_in_threadpool(db.get_chat_messages, current_user.username, before, limit)
+    messages = [{"id": id, "filename": filename, "question": question, "answer": answer, "created_at": created_at.isoformat()}
+                for id, filename, question, answer, created_at in rows]
+    next_before = rows[-1][0] if len(rows) == limit else None
+    return {"messages": messages, "next_before": next_before}
+
+
+DOCUMENT_STATUSES = {"ingesting", "ready", "failed", "deleted"}
+
+
+def catalog_etag(version, include_deleted):
+    return '"' + hashlib.sha256(f"{version}-{include_deleted}".encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def etag_matches(etag, if_none_match):
+    """If-None-Match holds "*" or a comma-separated list of tags, compared weakly."""
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+@app.get("/documents")
+async def list_documents(request: Request, response: Response, include_deleted: bool = False,
+                         current_user: UserInDB = Depends(get_current_user)):
+    """The document catalog. Send the ETag back in If-None-Match to get a
+    304 with no body until the catalog changes."""
+    version = await run_in_threadpool(db.get_catalog_version)
+    if version is None:
+        raise HTTPException(status_code=503, detail="Document catalog unavailable")
+    etag = catalog_etag(version, include_deleted)
+    if etag_matches(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers={"ETag": etag})
+    documents = await run_in_threadpool(db.get_documents, include_deleted)
+    if documents is None:
+        raise HTTPException(status_code=503, detail="Document catalog unavailable")
+    response.headers["ETag"] = etag
+    return {"documents": documents}
+
+
+@app.put("/documents/{filename}")
+async def update_document(filename: str, record: DocumentRecord, current_user: UserInDB = Depends(get_current_user)):
+    if record.status not in DOCUMENT_STATUSES:
+        raise HTTPException(status_code=422, detail=f"status must be one of {sorted(DOCUMENT_STATUSES)}")
+    document = await run_in_threadpool(db.upsert_document, filename, record.status, record.chunk_count,
+                                       record.first_id, record.last_id, record.vector_ids)
+    if document is None:
+        raise HTTPException(status_code=503, detail="Document catalog unavailable")
+    if record.status != "ingesting":
+        # A new, replaced or deleted document changes what cached answers were built on
+        answers.invalidate(filename)
+    return document
+
+
+@app.get("/documents/{filename}/vectors")
+async def document_vectors(filename: str, current_user: UserInDB = Depends(get_current_user)):
+    """IDs of the vectors a document was stored as, ids is null for documents
+    ingested before IDs were recorded."""
+    return {"filename": filename, "ids": await run_in_threadpool(db.get_document_vector_ids, filename)}
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+GPT_MODEL = "gpt-3.5-turbo"
+# Questions being answered at once by this worker, the rest wait their turn
+ANSWER_CONCURRENCY = int(os.getenv('ANSWER_CONCURRENCY', '32'))
+query_embeddings = QueryEmbeddingCache()
+answers = SemanticAnswerCache()
+openai_client = OpenAIClient()
+answer_slots = asyncio.Semaphore(ANSWER_CONCURRENCY)
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await openai_client.aclose()
+    credential_pool.shutdown(wait=False)
+
+
+async def get_query_embedding(query, api_key):
+    return (await get_query_embeddings([query], api_key))[0]
+
+
+async def get_query_embeddings(queries, api_key):
+    # Repeated questions skip the round trip to the embeddings API,
+    # the rest are embedded together in one request
+    embeddings = {query: query_embeddings.get(EMBEDDING_MODEL, query) for query in queries}
+    missing = [query for query, embedding in embeddings.items() if embedding is None]
+    if missing and query_embeddings.shared:
+        # The shared store is a file that can be locked, keep it off the event loop
+        embeddings.update(await run_in_threadpool(query_embeddings.get_shared, EMBEDDING_MODEL, missing))
+        missing = [query for query in missing if embeddings[query] is None]
+    if missing:
+        computed = dict(zip(missing, await openai_client.embed(api_key, missing, EMBEDDING_MODEL)))
+        for query, embedding in computed.items():
+            query_embeddings.put(EMBEDDING_MODEL, query, embedding)
+        embeddings.update(computed)
+        if query_embeddings.shared:
+            await run_in_threadpool(query_embeddings.put_shared, EMBEDDING_MODEL, computed)
+    return [embeddings[query] for query in queries]
+
+
+def query_index(xq, filename):
+    # Vectors come back too, for diversifying the retrieved chunks
+    if filename.lower() == 'all':
+        return index.query(
             vector=xq,
-            top_k=1,
+            top_k=RETRIEVAL_TOP_K,
             include_metadata=True,
-            filter={"Filename": {"$eq": query_model.filename}}
+            include_values=True
         )
+    return index.query(
+        vector=xq,
+        top_k=RETRIEVAL_TOP_K,
+        include_metadata=True,
+        include_values=True,
+        filter={"Filename": {"$eq": filename}}
+    )
 
-    # Extract the text from search results
-    if len(res['matches']) == 0:
-        results = ''
-    else:
-        results = res['matches'][0]['metadata']['Text']
+
+@app.get("/metrics/query-cache")
+async def query_cache_metrics(current_user: UserInDB = Depends(get_current_user)):
+    return query_embeddings.stats()
+
+
+@app.post("/answer/")
+async def answer_question(query_model: QueryModel, openai_model: OpenAIModel, current_user: UserInDB = Security(get_current_user)):
+    async with answer_slots:
+        return await answer(query_model, openai_model.api_key)
+
+
+async def retrieve(query_model, api_key, xq=None):
+    """Embed the question and pack its context, returns (embedding, matches, prompt)."""
+    if xq is None:
+        xq = await get_query_embedding(query_model.query, api_key)
+    # The vector store client is blocking, keep it off the event loop
+    res = await run_in_threadpool(query_index, xq, query_model.filename)
+
+    # Diverse, deduplicated chunks under the context token budget
+    matches, results, _ = pack_context(res['matches'], xq, question=query_model.query)
 
     # Build the prompt with the search results and the user's question
     prompt = construct_prompt(results, query_model.query)
-    
-    
+    return xq, matches, prompt
+
+
+def chat_messages(prompt):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def context_report(matches, prompt):
+    return {
+        "ids": [match['id'] for match in matches],
+        "prompt_tokens": count_tokens(prompt),
+    }
+
+
+def source_documents(matches):
+    return [match['metadata'].get('Filename') for match in matches]
+
+
+async def answer(query_model, api_key, xq=None, slots=None):
+    """slots, when given, is held only around the completion call."""
+    xq, matches, prompt = await retrieve(query_model, api_key, xq)
+    context = context_report(matches, prompt)
+
+    # Near-identical questions answered from the same context are reused
+    cache_key = context_key(query_model.filename, matches)
+    cached = answers.get(cache_key, xq)
+    if cached is not None:
+        return {**cached, 'cached': True, 'context': context}
+
     # Generate the answer with OpenAI API using the prompt
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    return response
+    if slots is None:
+        response = await openai_client.chat(api_key, chat_messages(prompt), GPT_MODEL)
+    else:
+        async with slots:
+            response = await openai_client.chat(api_key, chat_messages(prompt), GPT_MODEL)
+    answers.put(cache_key, source_documents(matches), xq, response)
+    return {**response, 'cached': False, 'context': context}
+
+
+def sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+@app.post("/answer/stream")
+async def answer_question_stream(query_model: QueryModel, openai_model: OpenAIModel, current_user: UserInDB = Security(get_current_user)):
+    """Server-sent events: {"token": ...} per completion token, then
+    {"done": true, "cached": ..., "context": ...}."""
+    api_key = openai_model.api_key
+    async with answer_slots:
+        xq, matches, prompt = await retrieve(query_model, api_key)
+    context = context_report(matches, prompt)
+    cache_key = context_key(query_model.filename, matches)
+    cached = answers.get(cache_key, xq)
+
+    async def events():
+        if cached is not None:
+            yield sse({"token": cached['choices'][0]['message']['content']})
+            yield sse({"done": True, "cached": True, "context": context})
+            return
+        tokens = []
+        # The slot is held while tokens stream and released if the client goes away
+        async with answer_slots:
+            try:
+                async for token in openai_client.stream_chat(api_key, chat_messages(prompt), GPT_MODEL):
+                    tokens.append(token)
+                    yield sse({"token": token})
+            except HTTPException as e:
+                yield sse({"error": e.detail})
+                return
+        response = {"choices": [{"message": {"role": "assistant", "content": ''.join(tokens)}}]}
+        answers.put(cache_key, source_documents(matches), xq, response)
+        yield sse({"done": True, "cached": False, "context": context})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/answer/batch")
+async def answer_question_batch(batch: BatchQueryModel, openai_model: OpenAIModel, current_user: UserInDB = Security(get_current_user)):
+    """Newline-delimited JSON, one {"index": ..., "answer": ...} or
+    {"index": ..., "error": ...} line per item in the order they finish."""
+    api_key = openai_model.api_key
+    items = batch.items
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} questions per batch")
+
+    async def answer_item(i, query_model, xq):
+        try:
+            return {"index": i, "answer": await answer(query_model, api_key, xq, answer_slots)}
+        except HTTPException as e:
+            return {"index": i, "error": e.detail}
+        except Exception as e:
+            return {"index": i, "error": str(e)}
+
+    async def results():
+        try:
+            embeddings = await get_query_embeddings([item.query for item in items], api_key)
+        except HTTPException as e:
+            for i in range(len(items)):
+                yield json.dumps({"index": i, "error": e.detail}) + "\n"
+            return
+        # Retrieval runs for every item at once, completions wait for a free slot
+        tasks = [asyncio.ensure_future(answer_item(i, item, xq))
+                 for i, (item, xq) in enumerate(zip(items, embeddings))]
+        try:
+            for result in asyncio.as_completed(tasks):
+                yield json.dumps(await result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.post("/answer/cache/invalidate")
+async def invalidate_answers(document: DocumentModel, current_user: UserInDB = Depends(get_current_user)):
+    return {"invalidated": answers.invalidate(document.filename)}
+
+
+@app.get("/metrics/user-cache")
+async def user_cache_metrics(current_user: UserInDB = Depends(get_current_user)):
+    return {"users": user_cache.users.stats(), "tokens": user_cache.tokens.stats()}
+
+
+@app.get("/metrics/answer-cache")
+async def answer_cache_metrics(current_user: UserInDB = Depends(get_current_user)):
+    return answers.stats()
 
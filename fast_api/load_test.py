@@ -0,0 +1,85 @@
+"""Throughput of /answer/ one request at a time vs n at once.
+
+OpenAI is replaced by an in-process stand-in that answers after
+LOAD_TEST_LATENCY seconds and the index by a LocalIndex, so only this
+service's own concurrency is measured. With a non-blocking answer path the
+concurrent run should be close to n times faster.
+
+Usage: python load_test.py [n]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+# The answer path needs no database, a local one is only tried at import
+os.environ.setdefault('RDS_HOST', '127.0.0.1')
+os.environ.setdefault('RDS_PORT', '5432')
+os.environ.setdefault('RDS_DB_NAME', 'load_test')
+os.environ.setdefault('RDS_USER', 'load_test')
+os.environ.setdefault('RDS_PASSWORD', 'load_test')
+os.environ['VECTOR_STORE'] = 'local'
+os.environ['VECTOR_STORE_PATH'] = tempfile.mkdtemp(prefix='load_test_index_')
+
+import httpx
+import numpy as np
+
+import fast_api as api
+
+LATENCY = float(os.getenv('LOAD_TEST_LATENCY', '0.2'))
+EMBEDDING_DIM = 1536
+DOCUMENT_CHUNKS = 200
+
+
+async def openai_stand_in(request):
+    await asyncio.sleep(LATENCY)
+    if request.url.path.endswith('/embeddings'):
+        inputs = json.loads(request.content)['input']
+        # Random embeddings, so no two questions share a cached answer
+        return httpx.Response(200, json={'data': [
+            {'index': i, 'embedding': np.random.rand(EMBEDDING_DIM).tolist()} for i in range(len(inputs))]})
+    return httpx.Response(200, json={'choices': [{'message': {'role': 'assistant', 'content': 'Answer.'}}]})
+
+
+def seed_index():
+    vectors = np.random.rand(DOCUMENT_CHUNKS, EMBEDDING_DIM)
+    api.index.upsert([(f"load_test.pdf-{i}", vector.tolist(), {'Filename': 'load_test.pdf', 'Text': f"Chunk {i}."})
+                      for i, vector in enumerate(vectors)])
+
+
+async def run(client, requests, concurrent):
+    async def ask(i):
+        response = await client.post('/answer/', json={
+            'query_model': {'query': f"Question {concurrent} {i}?", 'filename': 'all'},
+            'openai_model': {'api_key': 'load-test'},
+        })
+        response.raise_for_status()
+
+    start = time.perf_counter()
+    if concurrent:
+        await asyncio.gather(*[ask(i) for i in range(requests)])
+    else:
+        for i in range(requests):
+            await ask(i)
+    return requests / (time.perf_counter() - start)
+
+
+async def main(requests):
+    api.openai_client.http = httpx.AsyncClient(transport=httpx.MockTransport(openai_stand_in),
+                                               base_url='http://openai.load-test')
+    api.app.dependency_overrides[api.get_current_user] = lambda: api.UserInDB(username='load_test', email='')
+    seed_index()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url='http://api.load-test',
+                                 timeout=None) as client:
+        sequential = await run(client, requests, concurrent=False)
+        concurrent = await run(client, requests, concurrent=True)
+    await api.openai_client.aclose()
+    print(f"{requests} requests, {LATENCY * 1000:.0f} ms upstream latency: "
+          f"sequential {sequential:.1f} req/s, concurrent {concurrent:.1f} req/s "
+          f"({concurrent / sequential:.1f}x)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,73 @@
+import json
+import os
+
+import httpx
+from fastapi import HTTPException
+
+# Point this at a local stand-in server for load tests
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '100'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+
+
+class OpenAIClient:
+    """Async OpenAI REST client sharing one pooled HTTP transport.
+
+    The API key is passed per call, so concurrent requests made with
+    different users' keys never touch shared state.
+    """
+
+    def __init__(self, base_url=OPENAI_API_BASE, max_connections=OPENAI_MAX_CONNECTIONS, timeout=OPENAI_TIMEOUT):
+        self.http = httpx.AsyncClient(
+            base_url=base_url.rstrip('/'),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+
+    async def _post(self, path, api_key, payload):
+        try:
+            response = await self.http.post(path, json=payload, headers={'Authorization': f'Bearer {api_key}'})
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            # Bad keys and rate limits are the caller's to handle, the rest is upstream failure
+            raise HTTPException(status_code=status if status in (400, 401, 429) else 502,
+                                detail=f"OpenAI request failed: {e.response.text}")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"OpenAI request failed: {e}")
+        return response.json()
+
+    async def embed(self, api_key, inputs, model):
+        data = await self._post('/embeddings', api_key, {'model': model, 'input': inputs})
+        return [d['embedding'] for d in sorted(data['data'], key=lambda d: d['index'])]
+
+    async def chat(self, api_key, messages, model):
+        return await self._post('/chat/completions', api_key, {'model': model, 'messages': messages})
+
+    async def stream_chat(self, api_key, messages, model):
+        """Yield completion tokens as the API generates them."""
+        payload = {'model': model, 'messages': messages, 'stream': True}
+        try:
+            async with self.http.stream('POST', '/chat/completions', json=payload,
+                                        headers={'Authorization': f'Bearer {api_key}'}) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith('data: '):
+                        continue
+                    data = line[len('data: '):]
+                    if data == '[DONE]':
+                        break
+                    delta = json.loads(data)['choices'][0].get('delta', {})
+                    if delta.get('content'):
+                        yield delta['content']
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            raise HTTPException(status_code=status if status in (400, 401, 429) else 502,
+                                detail=f"OpenAI request failed: {e.response.text}")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"OpenAI request failed: {e}")
+
+    async def aclose(self):
+        await self.http.aclose()
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '10000'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '86400'))
+# Optional SQLite file shared by all workers on the host
+QUERY_CACHE_PATH = os.getenv('QUERY_CACHE_PATH')
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    """LRU cache with a TTL for query embeddings, keyed by (model, normalized query).
+
+    Entries live in memory per worker. With a path, misses fall through to
+    a SQLite store so an embedding computed by one worker serves them all.
+    get and put only touch memory, get_shared and put_shared the store.
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, path=QUERY_CACHE_PATH):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Separate from lock, so in-memory lookups never wait on the file
+        self.db_lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            self.conn.commit()
+
+    def _key(self, model, query):
+        return hashlib.sha256(f'{model}\0{normalize_query(query)}'.encode('utf-8')).hexdigest()
+
+    @property
+    def shared(self):
+        return self.conn is not None
+
+    def get(self, model, query):
+        """In-memory lookup only, cheap enough for the event loop."""
+        key = self._key(model, query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.entries.pop(key, None)
+            if self.conn is None:
+                self.misses += 1
+        return None
+
+    def put(self, model, query, embedding):
+        with self.lock:
+            self._remember(self._key(model, query), embedding, time.time() + self.ttl)
+
+    # The shared store is a file that another worker may hold locked for up to
+    # the connection timeout. Call these from a worker thread, never the event loop
+
+    def get_shared(self, model, queries):
+        """Embeddings found in the shared store, by query. They are kept in memory too."""
+        found = {}
+        now = time.time()
+        for query in queries:
+            key = self._key(model, query)
+            try:
+                with self.db_lock:
+                    row = self.conn.execute("SELECT embedding, expires FROM query_embeddings WHERE key = ? AND expires > ?",
+                                            (key, now)).fetchone()
+            except sqlite3.Error as e:
+                # The store is only a cache, a locked or broken file counts as a miss
+                print("Query cache store unavailable:", e)
+                row = None
+            with self.lock:
+                if row:
+                    found[query] = array('f', row[0]).tolist()
+                    self._remember(key, found[query], row[1])
+                    self.shared_hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_shared(self, model, embeddings):
+        """Store embeddings by query in the shared store."""
+        expires = time.time() + self.ttl
+        rows = [(self._key(model, query), array('f', embedding).tobytes(), expires)
+                for query, embedding in embeddings.items()]
+        with self.db_lock:
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)", rows)
+                self.conn.execute("DELETE FROM query_embeddings WHERE expires <= ?", (time.time(),))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                print("Query cache store unavailable:", e)
+                self.conn.rollback()
+
+    def _remember(self, key, embedding, expires):
+        self.entries[key] = (embedding, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
@@ -1,103 +1,45 @@
 import requests
 import streamlit as st
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 import pandas as pd
-import time
-import pinecone
-import boto3
-import numpy as np
-import openai
-import io
-import PyPDF2
-from textblob import TextBlob
-import tiktoken
-import nltk
-import numpy as np
-nltk.download('punkt')
-import csv
-
-
-
-#Conecting to Pine cone database
-try:
-    pinecone.init(api_key=st.secrets['PINECONE_API_KEY'], environment=st.secrets['PINECONE_ENV'])
-    index = pinecone.Index('bigdata')
-    print("Pinecone initialization and index creation successful.")
-except Exception as e:
-    print("An error occurred:", str(e))
-
-
-#Connecting to S3 bucket
-s3_bucket = 'csv07'
-s3_object_key = 'filenames.csv'
-aws_access_key_id = st.secrets['AWS_ACCESS_KEY_ID']
-aws_secret_access_key = st.secrets['AWS_SECRET_ACCESS_KEY']
-aws_region = st.secrets['AWS_REGION']
+from pdf_wizard import chunking
+from pdf_wizard.embeddings import EmbeddingEngine
+from pdf_wizard.embedding_cache import get_cache
+from pdf_wizard.pdf_text import spool_to_file, map_file, read_pdf
+from pdf_wizard.segmenter import iter_sentences
+from pdf_wizard.upserts import upsert_frame, delete_ids, delete_by_filter_query
+from pdf_wizard.manifest import chunk_hash, vector_id
+from pdf_wizard.vector_store import flush
+from resources import get_index, api_session, list_documents, documents_changed
+
+
+
+#Conecting to Pine cone database, once per process
+index = get_index()
 API_ENDPOINT = st.secrets['FASTAPI_ENDPOINT']
-s3_client = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,region_name=aws_region)
 EMBEDDING_MODEL = "text-embedding-ada-002"
+CHUNK_TOKENS = int(st.secrets.get('CHUNK_TOKENS', chunking.CHUNK_TOKENS))
+CHUNK_OVERLAP_TOKENS = int(st.secrets.get('CHUNK_OVERLAP_TOKENS', chunking.CHUNK_OVERLAP_TOKENS))
 GPT_MODEL = "gpt-3.5-turbo"
 
 
 
 def gen_embed(chunk_list, api_key):
-    embed_list = []
-    openai.api_key = api_key
-    for i in chunk_list:
-        text_embedding_response = openai.Embedding.create(
-            model=EMBEDDING_MODEL,
-            input=i,
-        )
-        text_embedding = text_embedding_response["data"][0]["embedding"]
-        embed_list.append(text_embedding)
-        time.sleep(20)
+    cache = get_cache()
+    engine = EmbeddingEngine(api_key, EMBEDDING_MODEL, cache=cache)
+    embed_list = engine.embed(chunk_list)
+    print("Embedding cache:", cache.stats())
     return embed_list
 
 
-def extract_sentences(text):
-    blob = TextBlob(text)
-    sentence_list = []
-    # Iterate through the sentences and append them to the list
-    for sentence in blob.sentences:
-        sentence_list.append(sentence.raw)
-    return sentence_list
-
-
-def extract_text_with_pypdf2(pdf_content):
-    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-    text = ""
-    meta_data = pdf_reader.metadata
-    meta_data = list(meta_data.values())[0]
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text += page.extract_text()
-    return [meta_data,text]
-
-def create_chunk_list(sentence_list):
-    l = len(sentence_list)
-    chunk_list = []
-    chunk = ''
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    for i in range(l):
-        chunk+=sentence_list[i]
-        if len(encoding.encode(chunk))<3000:
-            if i==l-1:
-                chunk_list.append(chunk)
-            continue
-        else:
-            chunk_list.append(chunk)
-            chunk = ''
-    return chunk_list
-
 
 def extract_pdf_content(link, api_key):
     filename = link.split('/')[-1]
-    pdf_response = requests.get(link)
-    pdf_content = pdf_response.content
-    meta_data, pdf_text = extract_text_with_pypdf2(pdf_content)
-    sentences_list = extract_sentences(pdf_text.strip())
-    chunk_list = create_chunk_list(sentences_list)
+    pdf_response = requests.get(link, stream=True, timeout=(10, 120))
+    pdf_response.raise_for_status()
+    # Pages are extracted, split and chunked one at a time
+    with spool_to_file(pdf_response) as pdf_file, map_file(pdf_file) as pdf_content:
+        meta_data, pages = read_pdf(pdf_content)
+        chunk_list = chunking.create_chunk_list(iter_sentences(pages), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
     embeddings_list = gen_embed(chunk_list, api_key)
     df_temp = pd.DataFrame({'Filename':filename,'Metadata': meta_data,'Text': chunk_list, 'Embeddings':embeddings_list})
     
@@ -106,72 +48,33 @@ def extract_pdf_content(link, api_key):
 
 #########################################################################################
 
-def get_ids_from_query(index,input_vector):
-  results = index.query(vector=input_vector, top_k=10000,include_values=False)
-  ids = set()
-  for result in results['matches']:
-    ids.add(result['id'])
-  return ids
-
-
-def get_all_ids_from_index(index, num_dimensions, namespace=""):
-  
-    input_vector = np.random.rand(1536).tolist()
-    results = index.query(vector=input_vector, top_k=100,include_values=False)
-    all_ids = []
-    for i in results['matches']:
-        all_ids.append(str(i['id']))
-  
-#   num_vectors = index.describe_index_stats()["namespaces"][""]["vector_count"]
-# #   ["namespaces"]['']['vector_count']
-#   print("Num Vectors:",num_vectors)
-#   all_ids = set()
-#   while len(all_ids) < num_vectors:
-#     input_vector = np.random.rand(num_dimensions).tolist()
-#     ids = get_ids_from_query(index,input_vector)
-#     all_ids.update(ids)
-    return all_ids
-
-
 def add_to_pinecone(df):
-    starting_index = max([int(i) for i in get_all_ids_from_index(index,1536)])+1
-    df['Index'] = range(starting_index, starting_index + len(df))
-    df['Index'] = df['Index'].astype(str)
-
-    # Setting batch size as 32
-    batch_size = 32
-    for i in range(0, len(df), batch_size):
-        batch_df = df[i:i + batch_size]
-        id_list = batch_df['Index'].tolist()
-        embeds = batch_df['Embeddings'].tolist()
-        text_list = batch_df['Text'].tolist()
-        file_list = batch_df['Filename'].tolist()
-        metalist = batch_df['Metadata'].tolist()
-        m_list = []
-        for i in range(len(text_list)):
-            m = {'Filename': file_list[i], 'Text': text_list[i], 'Metadata': metalist[i]}
-            m_list.append(m)
-        to_upsert = zip(id_list, embeds, m_list) 
-        index.upsert(vectors=list(to_upsert))
-
-    
+    # IDs come from the filename and chunk text, as in the Airflow pipeline, so
+    # concurrent uploads never collide and re-uploading a chunk overwrites it
+    df['Index'] = [vector_id(f, chunk_hash(t)) for f, t in zip(df['Filename'], df['Text'])]
+    df = df.drop_duplicates('Index')
+    upsert_frame(index, df['Index'].tolist(), df['Embeddings'].tolist(), df)
+    return df['Index'].tolist()
 
 
-def upload_csv_to_s3(name):
-    file_path = st.secrets["FILENAME"]  # Replace with the path to your existing CSV file
-    df = pd.read_csv(file_path)
+def update_catalog(filename, status, ids=None):
+    """Record the document in the catalog, ids are the vectors it was stored as."""
+    record = {"status": status}
+    if ids is not None:
+        record.update(chunk_count=len(ids), first_id=ids[0] if ids else None, last_id=ids[-1] if ids else None,
+                      vector_ids=ids)
+    headers = {'Authorization': f"Bearer {st.session_state.get('access_token')}"}
+    response = api_session().put(f"{API_ENDPOINT}/documents/{filename}", headers=headers, json=record, timeout=10)
+    response.raise_for_status()
+    documents_changed()
 
-    # Create a new DataFrame with the additional file name
-    data_to_add = {'Name': [name]}
-    df_to_add = pd.DataFrame(data_to_add)
 
-    # Concatenate the two DataFrames
-    combined_df = pd.concat([df, df_to_add], ignore_index=True)
-
-    # Write the combined DataFrame back to the CSV file
-    combined_df.to_csv(file_path, index=False)
-     # Upload the CSV file, replacing it if it already exists.
-    s3_client.upload_file(st.secrets['FILENAME'], 'csv07', "filenames.csv")
+def registered_ids(filename):
+    """Vector IDs recorded in the catalog at upload, None for older documents."""
+    headers = {'Authorization': f"Bearer {st.session_state.get('access_token')}"}
+    response = api_session().get(f"{API_ENDPOINT}/documents/{filename}/vectors", headers=headers, timeout=10)
+    response.raise_for_status()
+    return response.json()['ids']
 
 
 
@@ -193,23 +96,32 @@ update_button = st.button("Update database")
 if update_button:
     if not link:
         st.warning("Please enter pdf link")
+    elif 'access_token' not in st.session_state:
+        st.warning("Please sign in on the Chatbot page to update the catalog")
     else:
         filename = link.split('/')[-1]
-        df = extract_pdf_content(link, api_key)
-        add_to_pinecone(df)
-        upload_csv_to_s3(filename)
+        previous_ids = registered_ids(filename) or []
+        update_catalog(filename, "ingesting")
+        try:
+            df = extract_pdf_content(link, api_key)
+            ids = add_to_pinecone(df)
+            # Chunks of an earlier version of the document that are gone now
+            delete_ids(index, set(previous_ids) - set(ids))
+            flush(index)
+        except Exception:
+            update_catalog(filename, "failed")
+            raise
+        update_catalog(filename, "ready", ids)
         st.success("Updated") 
         st.balloons()
 
 #########################################################################################
 
 def options_list():
-    # Read the file names from a CSV file
-    filename_df = pd.read_csv(st.secrets['FILENAME'], header=None)  # No header specified
-    # Extract the options as a list
-    options = filename_df[0].tolist()[1:] 
-    options =  [i.strip() for i in options]
-    return options
+    # The catalog is only listed to signed-in users
+    if 'access_token' not in st.session_state:
+        return []
+    return list_documents(st.session_state['access_token'])
 
 st.title("Delete a file from the Big Data Index")
 # Create a textbox for user input
@@ -222,12 +134,17 @@ delete_button = st.button("Delete file")
 if delete_button:
     if not file:
         st.warning("Please select a file name")
+    elif 'access_token' not in st.session_state:
+        st.warning("Please sign in on the Chatbot page to update the catalog")
     else:
         filename_to_delete = file
-        input_vector = np.random.rand(1536).tolist()
-        results = index.query(vector=input_vector, top_k=10000,include_values=False, filter={"Filename": filename_to_delete})
-        all_ids = [match['id'] for match in results['matches']]
-        delete_response = index.delete(ids=[all_ids[0]], namespace='')
-        print(delete_response)
-        st.success("Deleted!") 
+        ids = registered_ids(filename_to_delete)
+        if ids is not None:
+            deleted = delete_ids(index, ids)
+        else:
+            deleted = delete_by_filter_query(index, filename_to_delete)
+        flush(index)
+        update_catalog(filename_to_delete, "deleted", [])
+        print(f"Deleted {deleted} vectors of {filename_to_delete}")
+        st.success(f"Deleted {filename_to_delete}, {deleted} vectors removed")
         st.balloons()
\ No newline at end of file
@@ -3,73 +3,23 @@ import streamlit as st
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 import uuid
+import json
 import logging
-import pandas as pd
 import time
 import numpy as np
 import os
+from resources import api_session, list_documents
 
 
-import psycopg2
-
-RDS_HOST = st.secrets['RDS_HOST']
-RDS_PORT = st.secrets['RDS_PORT']
-RDS_DB_NAME = st.secrets['RDS_DB_NAME']
-RDS_USER = st.secrets['RDS_USER']
-RDS_PASSWORD = st.secrets['RDS_PASSWORD']
-DATABASE_URL = f"dbname='{RDS_DB_NAME}' user='{RDS_USER}' host='{RDS_HOST}' port={RDS_PORT} password='{RDS_PASSWORD}'"
-# psql --host=assignment-3.cg4vo6ofeasg.us-east-1.rds.amazonaws.com --port=5432 --username=postgres --password --dbname=a3 
-
-def get_connection():
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except psycopg2.Error as e:
-        print("Unable to connect to the database")
-        print(e)
-        return None
-    
-# Function to update user logs in the database
-import os
-
-# Function to update user logs in the database
-def update_user_logs(username, logs):
-    conn = get_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            # Check if the user already exists in the table
-            cursor.execute("SELECT * FROM logs WHERE username = %s", (username,))
-            user_exists = cursor.fetchone()
-
-            if user_exists:
-                # Update the existing user's logs
-                cursor.execute("UPDATE logs SET logs = %s WHERE username = %s", (logs, username))
-            else:
-                # Insert a new row for the user
-                cursor.execute("INSERT INTO logs (username, logs) VALUES (%s, %s)", (username, logs))
-
-            conn.commit()
-            cursor.close()
-        except psycopg2.Error as e:
-            print("Error updating user logs:", e)
-        finally:
-            conn.close()
-
 #########################################################################################
 API_ENDPOINT = st.secrets['FASTAPI_ENDPOINT']
+USER_DETAILS_TTL = int(st.secrets.get('USER_DETAILS_TTL', 60))
 logging.basicConfig(filename='info.log', level=logging.INFO)
 #########################################################################################
 
 #Function to get options list
 def options_list():
-    # Read the file names from a CSV file
-    filename_df = pd.read_csv(st.secrets['FILENAME'], header=None)  # No header specified
-    # Extract the options as a list
-    options = filename_df[0].tolist()[1:] 
-    options =  [i.strip() for i in options]
-    options.append('All')
-    return options
+    return list_documents(st.session_state['access_token']) + ['All']
 
 
 #Function to get token
@@ -86,7 +36,7 @@ def get_token(username, password):
 
     try:
         logging.info("Sending request")
-        response = requests.post(f"{API_ENDPOINT}/token", data=payload, headers=headers)
+        response = api_session().post(f"{API_ENDPOINT}/token", data=payload, headers=headers)
         if response.status_code == 200:
             token_data = response.json()
             st.success('Token retrieved successfully!')
@@ -113,7 +63,7 @@ def get_user_details(token, retries=1):
     for attempt in range(retries + 1):
         try:
             logging.info("Sending request")
-            response = requests.get(f"{API_ENDPOINT}/users", headers=headers)
+            response = api_session().get(f"{API_ENDPOINT}/users", headers=headers)
             response.raise_for_status()
             return response.json()
         except requests.HTTPError as http_err:
@@ -137,11 +87,20 @@ def get_user_details(token, retries=1):
             time.sleep(1)
     return None
 
-#Function to get answer
-def handle_new_message(question, file, api_key, token):
-    """Function to send a message to the chatbot and get a response."""
+#Function to get user details, cached so reruns skip the API call
+@st.cache_data(ttl=USER_DETAILS_TTL, show_spinner=False)
+def cached_user_details(token):
+    user_details = get_user_details(token, retries=1)
+    if user_details is None:
+        # Raised rather than returned, so a failure is retried on the next rerun
+        raise RuntimeError("Could not fetch user details")
+    return user_details
+
+#Function to stream an answer
+def stream_answer(question, file, api_key, token, placeholder):
+    """Function to stream the chatbot's answer, rendering tokens into placeholder as they arrive."""
     headers = {
-        'accept': 'application/json',
+        'accept': 'text/event-stream',
         'Authorization': f'Bearer {token}'
     }
     data = {
@@ -153,17 +112,68 @@ def handle_new_message(question, file, api_key, token):
             "api_key": api_key
         }
     }
+    answer = ''
     try:
         logging.info("Sending request")
-        response = requests.post(f"{API_ENDPOINT}/answer/", headers=headers, json=data)
-        response.raise_for_status()
-        logging.info("Response received")
-        return response.json()
+        with api_session().post(f"{API_ENDPOINT}/answer/stream", headers=headers, json=data, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data: '):
+                    continue
+                event = json.loads(line[len('data: '):])
+                if 'error' in event:
+                    st.error(f"Failed to get an answer: {event['error']}")
+                    return None
+                if 'token' in event:
+                    answer += event['token']
+                    placeholder.markdown(answer)
+                if event.get('done'):
+                    logging.info("Response received")
+                    return answer
+        # The stream ended before the answer was complete, it is not saved
+        logging.info("Answer stream ended early")
+        st.error("The answer was cut off, please try again.")
     except requests.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err} - Response Body: {http_err.response.text}")
+        logging.info(f"HTTP error occurred: {http_err} - Response Body: {http_err.response.text}")
+        st.error(f"Failed to get an answer: {http_err}")
     except Exception as e:
-        print(e,"culprit 2")
+        logging.info(f"An unexpected error occurred: {e}")
         st.error(f"An unexpected error occurred: {e}")
+    return None
+
+
+#Function to load the latest page of chat history
+def load_history(token):
+    headers = {
+        'accept': 'application/json',
+        'Authorization': f'Bearer {token}'
+    }
+    try:
+        response = api_session().get(f"{API_ENDPOINT}/history", headers=headers)
+        response.raise_for_status()
+        # Newest first from the API, oldest first on the page
+        return [{'question': m['question'], 'answer': m['answer'], 'filename': m['filename']}
+                for m in reversed(response.json()['messages'])]
+    except Exception as e:
+        logging.info(f"Could not load chat history: {e}")
+        return []
+
+
+#Function to save messages not yet stored
+def save_history(token):
+    pending = st.session_state.chat_history[st.session_state.saved_messages:]
+    if not pending:
+        return
+    headers = {
+        'accept': 'application/json',
+        'Authorization': f'Bearer {token}'
+    }
+    try:
+        response = api_session().post(f"{API_ENDPOINT}/history", headers=headers, json={"messages": pending})
+        response.raise_for_status()
+        st.session_state.saved_messages += len(pending)
+    except Exception as e:
+        logging.info(f"Could not save chat history: {e}")
 
 
 #Function to display chat history
@@ -178,6 +188,7 @@ def display_chat(history):
 if 'chat_history' not in st.session_state:
     logging.info("Initializing chat history")
     st.session_state.chat_history = []
+    st.session_state.saved_messages = 0
 
 # Sidebar for user authentication
 if 'access_token' not in st.session_state:
@@ -202,11 +213,18 @@ st.title('Chatbot')
 if 'access_token' in st.session_state:
     logging.info("Displaying chat form")
     # Retrieve and display user details
-    user_details = get_user_details(st.session_state.access_token, retries=1)
+    try:
+        user_details = cached_user_details(st.session_state.access_token)
+    except RuntimeError:
+        user_details = None
     if user_details:
         st.subheader(f"Welcome {user_details['username']}!")
         st.text(f"Email: {user_details['email']}")
         logging.info("User details displayed")
+    if 'history_loaded' not in st.session_state:
+        st.session_state.chat_history = load_history(st.session_state.access_token)
+        st.session_state.saved_messages = len(st.session_state.chat_history)
+        st.session_state.history_loaded = True
     
     # Input for new questions
     with st.form("chat_form"):
@@ -219,19 +237,21 @@ if 'access_token' in st.session_state:
     
     if submit_button and question and file and openai_key:
         logging.info("Handling new message")
-        print(st.session_state.access_token, "fectct")
-        answer_data = handle_new_message(question, file, openai_key, st.session_state.access_token)
-        print(answer_data)
-        if answer_data:
+        placeholder = st.empty()
+        answer = stream_answer(question, file, openai_key, st.session_state.access_token, placeholder)
+        if answer is not None:
             logging.info("Answer received")
             st.session_state.chat_history.append({
                 'question': question,
-                'answer': answer_data.get('choices', 'No answer returned')[0]['message']['content']
+                'answer': answer or 'No answer returned',
+                'filename': file
             })
-            update_user_logs(user_details['username'], st.session_state.chat_history)
+            save_history(st.session_state.access_token)
+            # The history below shows the answer, drop the streamed copy
+            placeholder.empty()
             display_chat(st.session_state.chat_history)
     else:
-        update_user_logs(user_details['username'], st.session_state.chat_history)
+        save_history(st.session_state.access_token)
         st.warning('Please enter ALL details to get an answer.')
         logging.info("No question submitted")
         display_chat(st.session_state.chat_history)
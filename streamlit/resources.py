@@ -0,0 +1,59 @@
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from pdf_wizard.vector_store import VECTOR_STORE_PATH, open_local_index
+
+API_ENDPOINT = st.secrets['FASTAPI_ENDPOINT']
+# Seconds before the catalog is checked again, uploads and deletes clear it sooner.
+# The check is a conditional request, so it is cheap when nothing changed
+DOCUMENT_LIST_TTL = int(st.secrets.get('DOCUMENT_LIST_TTL', 30))
+
+
+# Long-lived clients, created once per Streamlit process and shared by all sessions
+
+@st.cache_resource
+def get_index():
+    if st.secrets.get('VECTOR_STORE', 'pinecone') == 'local':
+        return open_local_index(st.secrets.get('VECTOR_STORE_PATH', VECTOR_STORE_PATH))
+    import pinecone
+    pinecone.init(api_key=st.secrets['PINECONE_API_KEY'], environment=st.secrets['PINECONE_ENV'])
+    print("Pinecone initialization and index creation successful.")
+    return pinecone.Index('bigdata')
+
+
+@st.cache_resource
+def api_session():
+    # Keeps connections to the FastAPI service alive between reruns
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=32))
+    session.mount('https://', HTTPAdapter(pool_maxsize=32))
+    return session
+
+
+@st.cache_resource
+def document_catalog():
+    # Last catalog seen by this process and its ETag, for conditional requests
+    return {'etag': None, 'documents': []}
+
+
+# Data read on every rerun, cached with a TTL
+
+@st.cache_data(ttl=DOCUMENT_LIST_TTL, show_spinner=False)
+def list_documents(token):
+    """Names of the documents ready to be queried, token is the signed-in user's."""
+    catalog = document_catalog()
+    headers = {'Authorization': f"Bearer {token}"}
+    if catalog['etag']:
+        headers['If-None-Match'] = catalog['etag']
+    response = api_session().get(f"{API_ENDPOINT}/documents", headers=headers, timeout=10)
+    if response.status_code != 304:
+        response.raise_for_status()
+        catalog['documents'] = [d['filename'] for d in response.json()['documents'] if d['status'] == 'ready']
+        catalog['etag'] = response.headers.get('ETag')
+    return list(catalog['documents'])
+
+
+def documents_changed():
+    """Call after an upload or delete so every page sees the new document list."""
+    list_documents.clear()